@@ -0,0 +1,102 @@
+"""Fabrique partagée de clients boto3 pour les scripts d'organisation"""
+
+import os
+import threading
+from collections import OrderedDict
+
+import boto3
+from botocore.config import Config
+
+from aws_credentials import DEFAULT_ROLE_NAME, DEFAULT_SESSION_NAME, get_credentials
+from aws_throttling import RETRY_CONFIG, get_governor
+
+# --- Config ---
+# Taille du pool HTTP de chaque client, alignée sur le niveau de parallélisme des scripts
+MAX_WORKERS = int(os.environ.get("MAX_WORKERS", "10"))
+# Nombre maximal de clients gardés en mémoire (les moins récemment utilisés sont libérés)
+MAX_CACHED_CLIENTS = int(os.environ.get("AWS_MAX_CACHED_CLIENTS", "256"))
+
+
+class ClientFactory:
+    """Crée et réutilise les clients boto3 par (compte, credentials, région, service).
+
+    Une seule session boto3 sert à tous les comptes : les modèles de service ne sont
+    chargés qu'une fois. Les credentials sont passés à chaque client, et l'AccessKeyId
+    fait partie de la clé du cache : un client n'est jamais réutilisé avec d'autres
+    credentials que ceux avec lesquels il a été créé. Chaque client est régulé par le
+    ThrottlingGovernor partagé (débit par service, région et compte, retries standard).
+
+    Args:
+        max_pool_connections (int): Connexions HTTP keep-alive par client.
+        max_clients (int): Nombre maximal de clients en cache.
+        botocore_session (botocore.session.Session|None): Session botocore à utiliser
+            (ex: analyse des réponses personnalisée), une nouvelle session sinon.
+    """
+
+    def __init__(self, max_pool_connections=MAX_WORKERS, max_clients=MAX_CACHED_CLIENTS, botocore_session=None):
+        self._session = boto3.session.Session(botocore_session=botocore_session)
+        self._config = Config(max_pool_connections=max_pool_connections, retries=RETRY_CONFIG)
+        self._max_clients = max_clients
+        self._clients = OrderedDict()
+        # Une session boto3 n'est pas thread-safe : la création des clients est sérialisée
+        self._lock = threading.Lock()
+
+    def client(self, service, region=None, account_id=None, credentials=None,
+               role_name=DEFAULT_ROLE_NAME, session_name=DEFAULT_SESSION_NAME, endpoint_url=None):
+        """Fonction pour obtenir un client boto3, depuis le cache si possible.
+
+        Args:
+            service (str): Nom du service AWS (ex: "lambda").
+            region (str|None): Région AWS, None pour la région par défaut.
+            account_id (str|None): Compte cible ; le rôle y est assumé si `credentials` est absent.
+            credentials (dict|None): Credentials temporaires STS déjà obtenus.
+            role_name (str): Rôle à assumer dans `account_id`.
+            session_name (str): RoleSessionName utilisé lors de l'AssumeRole.
+            endpoint_url (str|None): Endpoint alternatif (ex: stand-in S3 local).
+
+        Returns:
+            boto3.client: Client du service demandé.
+        """
+        if account_id and credentials is None:
+            credentials = get_credentials(account_id, role_name, session_name)
+        access_key = credentials["AccessKeyId"] if credentials else None
+        key = (account_id, access_key, region, service, endpoint_url)
+
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+
+            kwargs = {}
+            if credentials:
+                kwargs = {
+                    "aws_access_key_id": credentials["AccessKeyId"],
+                    "aws_secret_access_key": credentials["SecretAccessKey"],
+                    "aws_session_token": credentials["SessionToken"],
+                }
+            client = self._session.client(service, region_name=region, endpoint_url=endpoint_url,
+                                          config=self._config, **kwargs)
+            get_governor().register(client, service, region, account_id or access_key)
+            self._clients[key] = client
+            while len(self._clients) > self._max_clients:
+                self._clients.popitem(last=False)
+            return client
+
+
+_FACTORY = None
+_FACTORY_LOCK = threading.Lock()
+
+
+def get_factory():
+    """Fonction retournant la ClientFactory partagée du processus."""
+    global _FACTORY
+    with _FACTORY_LOCK:
+        if _FACTORY is None:
+            _FACTORY = ClientFactory()
+        return _FACTORY
+
+
+def get_client(service, region=None, account_id=None, credentials=None, **kwargs):
+    """Fonction raccourcie vers `get_factory().client(...)`."""
+    return get_factory().client(service, region, account_id, credentials, **kwargs)
@@ -0,0 +1,203 @@
+"""Cache partagé des credentials STS pour les scripts d'organisation"""
+
+import atexit
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import boto3
+from botocore.config import Config
+
+from aws_throttling import RETRY_CONFIG, get_governor
+
+# --- Config ---
+DEFAULT_ROLE_NAME = "AssumeRole_ReadOnlyAccess"
+DEFAULT_SESSION_NAME = "OrgScriptSession"
+# Les credentials sont renouvelés un peu avant leur expiration
+REFRESH_MARGIN = timedelta(minutes=5)
+# Nombre de comptes dont les credentials sont préchargés à l'avance
+PREFETCH_AHEAD = int(os.environ.get("AWS_CREDENTIALS_PREFETCH", "4"))
+# Cache disque optionnel (chiffré), actif uniquement si le fichier et la clé sont définis
+CACHE_FILE = os.environ.get("AWS_CREDENTIALS_CACHE_FILE")
+CACHE_KEY = os.environ.get("AWS_CREDENTIALS_CACHE_KEY")
+# Le cache disque est réécrit tous les SAVE_EVERY nouveaux credentials, et à la sortie du processus
+SAVE_EVERY = int(os.environ.get("AWS_CREDENTIALS_CACHE_SAVE_EVERY", "20"))
+
+
+class CredentialProvider:
+    """Fournit des credentials temporaires par (compte, rôle) en les gardant en cache
+    jusqu'à peu avant leur `Expiration`.
+
+    Args:
+        cache_file (str|None): Chemin du cache disque chiffré.
+        cache_key (str|None): Clé Fernet utilisée pour chiffrer le cache disque.
+        prefetch_workers (int): Nombre de threads dédiés au préchargement.
+    """
+
+    def __init__(self, cache_file=None, cache_key=None, prefetch_workers=PREFETCH_AHEAD):
+        self._sts = None
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._cache = {}
+        self._prefetched = set()
+        self._executor = ThreadPoolExecutor(max_workers=max(prefetch_workers, 1))
+        self._fernet = None
+        self._cache_file = None
+        self._unsaved = 0
+        # Sérialise les écritures du cache disque, sans bloquer les autres threads sur _lock
+        self._save_lock = threading.Lock()
+
+        if cache_file and cache_key:
+            try:
+                from cryptography.fernet import Fernet
+            except ImportError:
+                print("cryptography n'est pas installé, cache disque des credentials désactivé.")
+            else:
+                self._fernet = Fernet(cache_key)
+                self._cache_file = cache_file
+                self._load()
+                atexit.register(self.save)
+
+    def _sts_client(self):
+        with self._lock:
+            if self._sts is None:
+                self._sts = boto3.session.Session().client("sts", config=Config(retries=RETRY_CONFIG))
+                get_governor().register(self._sts, "sts", None, None)
+            return self._sts
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    @staticmethod
+    def _is_valid(credentials):
+        return credentials["Expiration"] - REFRESH_MARGIN > datetime.now(timezone.utc)
+
+    def get(self, account_id, role_name=DEFAULT_ROLE_NAME, session_name=DEFAULT_SESSION_NAME):
+        """Fonction pour obtenir les credentials d'un rôle dans un compte, depuis le cache si possible.
+
+        Args:
+            account_id (str): ID du compte AWS dans lequel assumer le rôle.
+            role_name (str): Nom du rôle à assumer.
+            session_name (str): RoleSessionName utilisé lors d'un nouvel AssumeRole.
+
+        Returns:
+            dict: Credentials temporaires (AccessKeyId, SecretAccessKey, SessionToken, Expiration)
+        """
+        key = (account_id, role_name)
+        # Un verrou par clé : un préchargement en cours n'est jamais dupliqué
+        with self._key_lock(key):
+            credentials = self._cache.get(key)
+            if credentials and self._is_valid(credentials):
+                return credentials
+
+            role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
+            credentials = self._sts_client().assume_role(
+                RoleArn=role_arn,
+                RoleSessionName=session_name
+            )["Credentials"]
+            with self._lock:
+                self._cache[key] = credentials
+                if self._cache_file:
+                    self._unsaved += 1
+                save_now = self._unsaved >= SAVE_EVERY
+            if save_now:
+                self.save()
+            return credentials
+
+    def prefetch(self, account_ids, role_name=DEFAULT_ROLE_NAME, session_name=DEFAULT_SESSION_NAME):
+        """Fonction pour lancer en arrière-plan l'obtention des credentials de plusieurs comptes.
+
+        Les erreurs sont ignorées ici, elles réapparaîtront lors du `get` du compte.
+        """
+        for account_id in account_ids:
+            key = (account_id, role_name)
+            with self._lock:
+                if key in self._prefetched:
+                    continue
+                self._prefetched.add(key)
+            self._executor.submit(self._prefetch_one, key, session_name)
+
+    def _prefetch_one(self, key, session_name):
+        try:
+            self.get(key[0], key[1], session_name)
+        finally:
+            # Une fois obtenus, les credentials pourront être préchargés de nouveau après expiration
+            with self._lock:
+                self._prefetched.discard(key)
+
+    def iter_with_prefetch(self, items, role_name=DEFAULT_ROLE_NAME, session_name=DEFAULT_SESSION_NAME,
+                           key=lambda item: item, lookahead=PREFETCH_AHEAD):
+        """Générateur parcourant `items` en préchargeant les credentials des `lookahead` suivants.
+
+        Args:
+            items (list): Comptes à parcourir (IDs ou dictionnaires).
+            key (callable): Fonction extrayant l'ID du compte d'un élément.
+            lookahead (int): Nombre de comptes préchargés à l'avance.
+        """
+        items = list(items)
+        for index, item in enumerate(items):
+            upcoming = items[index + 1:index + 1 + lookahead]
+            self.prefetch([key(i) for i in upcoming], role_name, session_name)
+            yield item
+
+    # --- Cache disque ---
+    def _load(self):
+        if not os.path.exists(self._cache_file):
+            return
+        try:
+            with open(self._cache_file, "rb") as f:
+                entries = json.loads(self._fernet.decrypt(f.read()))
+        except Exception as e:
+            print(f"Cache des credentials illisible, ignoré: {e}")
+            return
+        for entry in entries:
+            credentials = dict(entry["Credentials"])
+            credentials["Expiration"] = datetime.fromisoformat(credentials["Expiration"])
+            if self._is_valid(credentials):
+                self._cache[(entry["AccountId"], entry["RoleName"])] = credentials
+
+    def save(self):
+        """Fonction pour écrire le cache disque (chiffré) des credentials encore valides."""
+        if not self._cache_file:
+            return
+        with self._save_lock:
+            # Instantané pris sous _save_lock : une écriture n'en remplace jamais une plus récente
+            with self._lock:
+                if not self._unsaved:
+                    return
+                self._unsaved = 0
+                cache = list(self._cache.items())
+            entries = [{
+                "AccountId": account_id,
+                "RoleName": role_name,
+                "Credentials": {**credentials, "Expiration": credentials["Expiration"].isoformat()}
+            } for (account_id, role_name), credentials in cache if self._is_valid(credentials)]
+            self._write(entries)
+
+    def _write(self, entries):
+        tmp_file = f"{self._cache_file}.tmp"
+        fd = os.open(tmp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self._fernet.encrypt(json.dumps(entries).encode("utf-8")))
+        os.replace(tmp_file, self._cache_file)
+
+
+_PROVIDER = None
+_PROVIDER_LOCK = threading.Lock()
+
+
+def get_provider():
+    """Fonction retournant le CredentialProvider partagé du processus."""
+    global _PROVIDER
+    with _PROVIDER_LOCK:
+        if _PROVIDER is None:
+            _PROVIDER = CredentialProvider(cache_file=CACHE_FILE, cache_key=CACHE_KEY)
+        return _PROVIDER
+
+
+def get_credentials(account_id, role_name=DEFAULT_ROLE_NAME, session_name=DEFAULT_SESSION_NAME):
+    """Fonction raccourcie vers `get_provider().get(...)`."""
+    return get_provider().get(account_id, role_name, session_name)
@@ -0,0 +1,116 @@
+"""Découverte des régions activées de chaque compte, avec cache disque à durée de vie limitée"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from botocore.exceptions import ClientError
+
+from aws_clients import get_client
+from aws_credentials import DEFAULT_ROLE_NAME, DEFAULT_SESSION_NAME
+
+# --- Config ---
+CACHE_FILE = os.environ.get("AWS_REGIONS_CACHE_FILE", os.path.join(tempfile.gettempdir(), "aws_scripts_regions.json"))
+# Durée de validité (en secondes) des régions mises en cache : 24h par défaut
+CACHE_TTL = int(os.environ.get("AWS_REGIONS_CACHE_TTL", "86400"))
+# Les API account et ec2:DescribeRegions sont interrogées depuis cette région
+DISCOVERY_REGION = "us-east-1"
+
+
+class RegionResolver:
+    """Fournit les régions activées d'un compte, via account:ListRegions (ou ec2:DescribeRegions
+    à défaut) sous les credentials du compte, et les garde en cache sur disque.
+
+    Args:
+        cache_file (str|None): Fichier JSON du cache, None pour un cache en mémoire seulement.
+        ttl (int): Durée de validité d'une entrée, en secondes.
+    """
+
+    def __init__(self, cache_file=CACHE_FILE, ttl=CACHE_TTL):
+        self._cache_file = cache_file
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._cache = self._load()
+
+    def get_enabled_regions(self, account_id=None, allowed=None, role_name=DEFAULT_ROLE_NAME,
+                            session_name=DEFAULT_SESSION_NAME):
+        """Fonction pour obtenir les régions activées d'un compte.
+
+        Args:
+            account_id (str|None): Compte cible, None pour le compte courant.
+            allowed (list|None): Régions souhaitées ; seules celles activées sont gardées.
+            role_name (str): Rôle à assumer dans `account_id`.
+            session_name (str): RoleSessionName utilisé lors de l'AssumeRole.
+
+        Returns:
+            list: Régions activées (dans l'ordre de `allowed` si fourni, sinon triées).
+        """
+        key = account_id or "default"
+        with self._lock:
+            entry = self._cache.get(key)
+        if entry is None or entry["expires_at"] < time.time():
+            regions = self._discover(account_id, role_name, session_name)
+            entry = {"regions": regions, "expires_at": time.time() + self._ttl}
+            with self._lock:
+                self._cache[key] = entry
+                self._save()
+
+        if allowed is None:
+            return list(entry["regions"])
+        enabled = set(entry["regions"])
+        return [region for region in allowed if region in enabled]
+
+    @staticmethod
+    def _discover(account_id, role_name, session_name):
+        try:
+            account_client = get_client("account", DISCOVERY_REGION, account_id,
+                                        role_name=role_name, session_name=session_name)
+            paginator = account_client.get_paginator("list_regions")
+            regions = [region["RegionName"]
+                       for page in paginator.paginate(RegionOptStatusContains=["ENABLED", "ENABLED_BY_DEFAULT"])
+                       for region in page["Regions"]]
+        except ClientError:
+            # Sans account:ListRegions, DescribeRegions (sans AllRegions) ne renvoie que les régions activées
+            ec2 = get_client("ec2", DISCOVERY_REGION, account_id, role_name=role_name, session_name=session_name)
+            regions = [region["RegionName"] for region in ec2.describe_regions()["Regions"]]
+        return sorted(regions)
+
+    def _load(self):
+        if not self._cache_file or not os.path.exists(self._cache_file):
+            return {}
+        try:
+            with open(self._cache_file, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Cache des régions illisible, ignoré: {e}")
+            return {}
+
+    def _save(self):
+        if not self._cache_file:
+            return
+        now = time.time()
+        entries = {key: entry for key, entry in self._cache.items() if entry["expires_at"] >= now}
+        tmp_file = f"{self._cache_file}.tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_file, self._cache_file)
+
+
+_RESOLVER = None
+_RESOLVER_LOCK = threading.Lock()
+
+
+def get_resolver():
+    """Fonction retournant le RegionResolver partagé du processus."""
+    global _RESOLVER
+    with _RESOLVER_LOCK:
+        if _RESOLVER is None:
+            _RESOLVER = RegionResolver()
+        return _RESOLVER
+
+
+def get_enabled_regions(account_id=None, allowed=None, **kwargs):
+    """Fonction raccourcie vers `get_resolver().get_enabled_regions(...)`."""
+    return get_resolver().get_enabled_regions(account_id, allowed, **kwargs)
@@ -0,0 +1,182 @@
+"""Régulation adaptative du débit des appels AWS, partagée par tous les threads d'un script"""
+
+import os
+import threading
+import time
+from collections import Counter
+
+# --- Config ---
+# Régulation désactivée avec AWS_THROTTLE=0 (seule la politique de retry botocore s'applique)
+ENABLED = os.environ.get("AWS_THROTTLE", "1") != "0"
+# Débit (requêtes/s) de départ, plancher et plafond de chaque (service, région, compte)
+INITIAL_RATE = float(os.environ.get("AWS_THROTTLE_INITIAL_RATE", "10"))
+MIN_RATE = float(os.environ.get("AWS_THROTTLE_MIN_RATE", "0.5"))
+MAX_RATE = float(os.environ.get("AWS_THROTTLE_MAX_RATE", "50"))
+# AIMD : +1 requête/s par seconde d'appels réussis, débit divisé par 2 à chaque throttling
+INCREASE_STEP = 1.0
+DECREASE_FACTOR = 0.5
+# Une rafale de throttlings (requêtes déjà en vol) ne réduit le débit qu'une fois par fenêtre
+DECREASE_COOLDOWN = 1.0
+# Politique de retry botocore appliquée à tous les clients
+RETRY_CONFIG = {"mode": "standard", "max_attempts": int(os.environ.get("AWS_MAX_ATTEMPTS", "8"))}
+
+THROTTLE_ERROR_CODES = {
+    "Throttling", "ThrottlingException", "ThrottledException", "RequestThrottledException",
+    "TooManyRequestsException", "ProvisionedThroughputExceededException", "TransactionInProgressException",
+    "RequestLimitExceeded", "BandwidthLimitExceeded", "LimitExceededException", "RequestThrottled",
+    "SlowDown", "PriorRequestNotComplete", "EC2ThrottledException",
+}
+
+
+class TokenBucket:
+    """Seau à jetons au débit ajusté en AIMD, partagé par les threads appelant une même cible.
+
+    Args:
+        rate (float): Débit initial, en requêtes par seconde.
+    """
+
+    def __init__(self, rate=INITIAL_RATE):
+        self.rate = rate
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Fonction pour prendre un jeton, en attendant si le seau est vide.
+
+        Returns:
+            float: Temps d'attente, en secondes.
+        """
+        with self._lock:
+            now = time.monotonic()
+            # Rafale autorisée : une seconde de débit
+            self._tokens = min(max(self.rate, 1.0), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Le jeton est réservé tout de suite : les threads suivants attendent derrière celui-ci
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(MAX_RATE, self.rate + INCREASE_STEP / self.rate)
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= DECREASE_COOLDOWN:
+                self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+                self._last_decrease = now
+
+
+class ThrottlingGovernor:
+    """Régule les appels de tous les clients enregistrés, avec un seau par (service, région, compte).
+
+    S'accroche aux événements botocore de chaque client :
+        before-send     : prise d'un jeton avant chaque tentative
+        needs-retry     : succès (hausse du débit) ou throttling (baisse) après chaque tentative
+        request-created : fin de l'attente d'un retry, pour mesurer le temps de backoff
+    """
+
+    def __init__(self):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._counters = Counter()
+        self._throttles_by_key = Counter()
+
+    def bucket(self, key):
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = TokenBucket()
+            return self._buckets[key]
+
+    def _count(self, **increments):
+        with self._lock:
+            self._counters.update(increments)
+
+    def register(self, client, service, region, account):
+        """Fonction pour réguler un client boto3 (ses tentatives et retries compris).
+
+        Args:
+            client (boto3.client): Client à réguler.
+            service (str): Nom du service AWS.
+            region (str|None): Région du client.
+            account (str|None): Compte (ou identité) appelé.
+        """
+        if not ENABLED:
+            return
+        key = (service, region or client.meta.region_name, account or "default")
+        bucket = self.bucket(key)
+
+        def before_send(**kwargs):
+            waited = bucket.acquire()
+            self._count(requests=1, rate_wait_seconds=waited)
+
+        def needs_retry(response=None, caught_exception=None, request_dict=None, **kwargs):
+            if caught_exception is None and response is not None:
+                http_response, parsed = response
+                code = parsed.get("Error", {}).get("Code")
+                if code in THROTTLE_ERROR_CODES or http_response.status_code == 429:
+                    bucket.on_throttle()
+                    self._count(throttles=1)
+                    with self._lock:
+                        self._throttles_by_key[key] += 1
+                elif code is None and http_response.status_code < 400:
+                    bucket.on_success()
+                    return
+            if request_dict is not None:
+                # botocore attend le délai de retry avant de recréer la requête
+                request_dict["context"]["throttling_retry_from"] = time.monotonic()
+
+        def request_created(request=None, **kwargs):
+            retry_from = request.context.pop("throttling_retry_from", None) if request is not None else None
+            if retry_from is not None:
+                self._count(retries=1, backoff_seconds=time.monotonic() - retry_from)
+
+        client.meta.events.register("before-send", before_send)
+        client.meta.events.register("needs-retry", needs_retry)
+        client.meta.events.register("request-created", request_created)
+
+    def stats(self):
+        """Fonction retournant les compteurs : requests, throttles, retries,
+        rate_wait_seconds (attente d'un jeton) et backoff_seconds (attente avant retry)."""
+        with self._lock:
+            return {
+                "requests": self._counters["requests"],
+                "throttles": self._counters["throttles"],
+                "retries": self._counters["retries"],
+                "rate_wait_seconds": round(self._counters["rate_wait_seconds"], 3),
+                "backoff_seconds": round(self._counters["backoff_seconds"], 3),
+            }
+
+    def summary(self, top=5):
+        """Fonction retournant un résumé lisible des compteurs et des cibles les plus throttlées."""
+        stats = self.stats()
+        lines = [
+            f"Appels AWS : {stats['requests']} requêtes, {stats['throttles']} throttlings, "
+            f"{stats['retries']} retries ; attente débit {stats['rate_wait_seconds']}s, "
+            f"backoff {stats['backoff_seconds']}s"
+        ]
+        with self._lock:
+            most_throttled = self._throttles_by_key.most_common(top)
+            rates = {key: self._buckets[key].rate for key, _ in most_throttled}
+        for (service, region, account), count in most_throttled:
+            lines.append(f"  {service} {region} {account} : {count} throttlings, "
+                         f"débit actuel {rates[(service, region, account)]:.1f} req/s")
+        return "\n".join(lines)
+
+
+_GOVERNOR = None
+_GOVERNOR_LOCK = threading.Lock()
+
+
+def get_governor():
+    """Fonction retournant le ThrottlingGovernor partagé du processus."""
+    global _GOVERNOR
+    with _GOVERNOR_LOCK:
+        if _GOVERNOR is None:
+            _GOVERNOR = ThrottlingGovernor()
+        return _GOVERNOR
@@ -0,0 +1,84 @@
+"""Mesure du démarrage à froid et à chaud de report_lambda_with_deprecated_python
+
+Usage :
+    python bench_lambda_audit_cold_start.py [--runs 5]             # temps d'initialisation seul
+    python bench_lambda_audit_cold_start.py --invoke [--publish]   # + invocations à froid / à chaud
+
+L'initialisation est mesurée en important le module dans un processus neuf, comme lors
+d'un cold start. Avec --invoke, le handler est appelé deux fois dans le même processus
+(à froid puis à chaud) avec les credentials AWS courants ; le rapport SNS n'est
+réellement envoyé qu'avec --publish.
+"""
+
+import argparse
+import importlib
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+MODULE = "report_lambda_with_deprecated_python"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+class FakeContext:
+    """Contexte Lambda minimal, sans limite de temps effective."""
+
+    invoked_function_arn = "bench-lambda-audit"
+
+    def __init__(self, timeout_ms=24 * 3600 * 1000):
+        self.deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def measure_init(runs):
+    """Temps d'import du module (en secondes) dans `runs` processus neufs."""
+    code = f"import time; t = time.perf_counter(); import {MODULE}; print(time.perf_counter() - t)"
+    timings = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, cwd=HERE)
+        timings.append(float(out.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def measure_invocations(publish):
+    """Temps (en secondes) de l'import puis de deux invocations successives du handler."""
+    sys.path.insert(0, HERE)
+    start = time.perf_counter()
+    module = importlib.import_module(MODULE)
+    init = time.perf_counter() - start
+
+    if not publish:
+        module.publish_report = lambda results, errors: None
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        module.lambda_handler({}, FakeContext())
+        timings.append(time.perf_counter() - start)
+    return init, timings[0], timings[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Nombre de cold starts simulés")
+    parser.add_argument("--invoke", action="store_true", help="Invoque aussi le handler (nécessite AWS)")
+    parser.add_argument("--publish", action="store_true", help="Envoie réellement le rapport SNS")
+    args = parser.parse_args()
+
+    timings = measure_init(args.runs)
+    print(f"Init (import) : médiane {statistics.median(timings) * 1000:.1f} ms, "
+          f"min {min(timings) * 1000:.1f} ms, max {max(timings) * 1000:.1f} ms sur {args.runs} essais")
+
+    if args.invoke:
+        init, cold, warm = measure_invocations(args.publish)
+        print(f"Init          : {init * 1000:.1f} ms")
+        print(f"Invocation 1  : {cold * 1000:.1f} ms (à froid)")
+        print(f"Invocation 2  : {warm * 1000:.1f} ms (à chaud)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,31 @@
+import csv
+import json
+import os
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
 import boto3
-from botocore.exceptions import NoCredentialsError, ClientError
+
+from aws_clients import get_client
+from aws_credentials import get_credentials
+
+# Nombre de comptes traités en parallèle
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '10'))
+# Format de sortie : csv ou json
+OUTPUT_FORMAT = os.environ.get('OUTPUT_FORMAT', 'csv')
+# Mode de comptage :
+#   accounts : list_protected_resources dans chaque compte membre (rôle assumé partout)
+#   jobs     : depuis le compte management seul, via le monitoring cross-account d'AWS Backup
+COUNT_MODE = os.environ.get('BACKUP_COUNT_MODE', 'accounts')
+# Fenêtre (en jours) des jobs réussis pris en compte en mode jobs
+JOBS_WINDOW_DAYS = int(os.environ.get('BACKUP_JOBS_WINDOW_DAYS', '35'))
+# Régions interrogées en mode jobs (séparées par des virgules), région par défaut sinon
+JOBS_REGIONS = [r for r in os.environ.get('BACKUP_JOBS_REGIONS', '').split(',') if r] or [None]
+
+date_str = datetime.now(timezone.utc).strftime("%Y%m%d")
+OUTPUT_PREFIX = f"{date_str}_backup_protected_resources"
 
 def list_organization_accounts():
     org_client = boto3.client('organizations')
@@ -12,69 +38,144 @@ def list_organization_accounts():
     return accounts
 
 def assume_role(account_id, role_name):
-    sts_client = boto3.client('sts')
-
-    # Assume le rôle dans le compte cible
-    response = sts_client.assume_role(
-        RoleArn=f"arn:aws:iam::{account_id}:role/{role_name}",
-        RoleSessionName="BackupProtectedResourcesSession"
-    )
-
-    # Retourner les credentials pour la session
-    return response['Credentials']
+    # Assume le rôle dans le compte cible (credentials partagés et mis en cache jusqu'à expiration)
+    return get_credentials(account_id, role_name, "BackupProtectedResourcesSession")
 
-def count_protected_resources_in_account(credentials=None):
-    try:
-        if credentials:
-            # Si nous avons des credentials temporaires, les utiliser pour la session
-            backup_client = boto3.client(
-                'backup',
-                aws_access_key_id=credentials['AccessKeyId'],
-                aws_secret_access_key=credentials['SecretAccessKey'],
-                aws_session_token=credentials['SessionToken']
-            )
-        else:
-            # Utiliser la session par défaut pour le compte root
-            backup_client = boto3.client('backup')
+def count_protected_resources_by_type(credentials=None):
+    """Compte les ressources protégées d'un compte par ResourceType"""
+    # Avec des credentials temporaires si fournis, sinon la session par défaut pour le compte root
+    backup_client = get_client('backup', credentials=credentials)
 
-        # Paginator pour lister les ressources protégées
-        paginator = backup_client.get_paginator('list_protected_resources')
-        resource_count = 0
+    # Paginator pour lister les ressources protégées
+    paginator = backup_client.get_paginator('list_protected_resources')
+    counts = Counter()
 
-        for page in paginator.paginate():
-            # Compter le nombre de ressources protégées
-            resource_count += len(page['Results'])
+    for page in paginator.paginate():
+        for resource in page['Results']:
+            counts[resource.get('ResourceType', 'Unknown')] += 1
 
-        return resource_count
+    return counts
 
-    except (NoCredentialsError, ClientError) as e:
-        print(f"Erreur lors de l'accès aux ressources protégées: {str(e)}")
-        return 0
+def scan_account(account, management_account_id, role_name):
+    """Comptage d'un compte, avec sa durée et l'éventuelle erreur"""
+    account_id = account['Id']
+    start = time.perf_counter()
+    counts = Counter()
+    error = ""
+    try:
+        if account_id == management_account_id:
+            # Si c'est le compte root, ne pas assumer un rôle, utiliser la session actuelle
+            counts = count_protected_resources_by_type()
+        else:
+            # Assumer le rôle dans les autres comptes membres
+            counts = count_protected_resources_by_type(assume_role(account_id, role_name))
+    except Exception as e:
+        # Toute erreur (credentials, API, réseau, timeout) est propre au compte : les autres continuent
+        error = str(e)
+        print(f"Erreur lors de l'accès aux ressources protégées du compte {account_id}: {error}")
+    return {
+        'AccountId': account_id,
+        'AccountName': account.get('Name', ''),
+        'DurationSeconds': round(time.perf_counter() - start, 3),
+        'Total': sum(counts.values()),
+        'ByResourceType': dict(sorted(counts.items())),
+        'Error': error
+    }
+
+def collect_protected_resources_from_jobs(window_days=JOBS_WINDOW_DAYS, regions=JOBS_REGIONS):
+    """Ressources protégées par compte, déduites des jobs de sauvegarde et de copie réussis
+    de toute l'organisation (ByAccountId='*' depuis le compte management).
+
+    Returns:
+        dict: {AccountId: {ResourceArn: ResourceType}}
+    """
+    since = datetime.now(timezone.utc) - timedelta(days=window_days)
+    resources = defaultdict(dict)
+    for region in regions:
+        backup_client = get_client('backup', region)
+        for operation, result_key in (('list_backup_jobs', 'BackupJobs'), ('list_copy_jobs', 'CopyJobs')):
+            paginator = backup_client.get_paginator(operation)
+            for page in paginator.paginate(ByAccountId='*', ByState='COMPLETED', ByCompleteAfter=since):
+                for job in page[result_key]:
+                    resources[job['AccountId']][job['ResourceArn']] = job.get('ResourceType', 'Unknown')
+    return resources
+
+def count_from_jobs(accounts):
+    """Mêmes résultats que scan_account, pour tous les comptes, sans assumer de rôle"""
+    resources = collect_protected_resources_from_jobs()
+    results = []
+    for account in accounts:
+        counts = Counter(resources.get(account['Id'], {}).values())
+        results.append({
+            'AccountId': account['Id'],
+            'AccountName': account.get('Name', ''),
+            'DurationSeconds': None,  # pas de scan par compte dans ce mode
+            'Total': sum(counts.values()),
+            'ByResourceType': dict(sorted(counts.items())),
+            'Error': ""
+        })
+    return results
+
+def write_csv(results):
+    """Deux fichiers : comptes par (compte, ResourceType) et durée de chaque compte"""
+    counts_file = f"{OUTPUT_PREFIX}.csv"
+    with open(counts_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["AccountId", "AccountName", "ResourceType", "ResourceCount"])
+        for result in results:
+            for resource_type, count in result['ByResourceType'].items():
+                writer.writerow([result['AccountId'], result['AccountName'], resource_type, count])
+
+    timings_file = f"{OUTPUT_PREFIX}_timings.csv"
+    with open(timings_file, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["AccountId", "AccountName", "DurationSeconds", "ResourceCount", "Error"])
+        for result in results:
+            writer.writerow([result['AccountId'], result['AccountName'], result['DurationSeconds'],
+                             result['Total'], result['Error']])
+    return [counts_file, timings_file]
+
+def write_json(results):
+    totals = Counter()
+    for result in results:
+        totals.update(result['ByResourceType'])
+    json_file = f"{OUTPUT_PREFIX}.json"
+    with open(json_file, "w", encoding="utf-8") as f:
+        json.dump({
+            'Total': sum(totals.values()),
+            'ByResourceType': dict(sorted(totals.items())),
+            'Accounts': results
+        }, f, indent=2, ensure_ascii=False)
+    return [json_file]
 
 if __name__ == "__main__":
-    # Liste des comptes de l'organisation via AWS Organizations
-    accounts = list_organization_accounts()
-
-    total_resources = 0
+    # Liste des comptes actifs de l'organisation via AWS Organizations
+    accounts = [acc for acc in list_organization_accounts() if acc['Status'] == 'ACTIVE']
     role_name = "OrganizationAccountAccessRole"  # Rôle utilisé pour accéder aux comptes membres
-    for account in accounts:
-        account_id = account['Id']
-        account_status = account['Status']
-
-        # Vérifier que le compte est actif avant de l'interroger
-        if account_status == 'ACTIVE':
-            print(f"Comptage des ressources protégées pour le compte {account_id}...")
-
-            if account_id == boto3.client('sts').get_caller_identity()['Account']:
-                # Si c'est le compte root, ne pas assumer un rôle, utiliser la session actuelle
-                resources_in_account = count_protected_resources_in_account()
-            else:
-                # Assumer le rôle dans les autres comptes membres
-                credentials = assume_role(account_id, role_name)
-                resources_in_account = count_protected_resources_in_account(credentials)
-
-            print(f"Nombre de ressources protégées dans le compte {account_id}: {resources_in_account}")
-
-            total_resources += resources_in_account
 
+    print(f"Comptage des ressources protégées pour {len(accounts)} comptes (mode {COUNT_MODE})...")
+    if COUNT_MODE == 'jobs':
+        start = time.perf_counter()
+        results = count_from_jobs(accounts)
+        print(f"Jobs réussis des {JOBS_WINDOW_DAYS} derniers jours analysés en {time.perf_counter() - start:.1f}s")
+        for result in results:
+            print(f"Nombre de ressources protégées dans le compte {result['AccountId']}: {result['Total']}")
+    else:
+        # Compte courant (management), résolu une seule fois
+        management_account_id = boto3.client('sts').get_caller_identity()['Account']
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            results = list(executor.map(lambda acc: scan_account(acc, management_account_id, role_name), accounts))
+
+        for result in results:
+            print(f"Nombre de ressources protégées dans le compte {result['AccountId']}: {result['Total']} "
+                  f"({result['DurationSeconds']}s)")
+
+        # Comptes qui dominent la durée du scan
+        print("Comptes les plus lents :")
+        for result in sorted(results, key=lambda r: r['DurationSeconds'], reverse=True)[:5]:
+            print(f"  {result['AccountId']} ({result['AccountName']}): {result['DurationSeconds']}s")
+
+    output_files = write_json(results) if OUTPUT_FORMAT == 'json' else write_csv(results)
+    total_resources = sum(result['Total'] for result in results)
     print(f"Nombre total de ressources protégées dans toute l'organisation: {total_resources}")
+    print(f"Résultats écrits dans : {', '.join(output_files)}")
@@ -0,0 +1,66 @@
+"""Tag compliance of the resource inventory, computed with pandas columnar operations."""
+
+import numpy as np
+import pandas as pd
+
+# Value the inventory writes for an absent tag
+MISSING_VALUE = 'N/A'
+# Rows processed per chunk: memory stays bounded whatever the inventory size
+CHUNK_SIZE = 1000000
+GROUP_COLUMNS = ['Account', 'Service']
+
+
+def count_missing(frame, tags):
+    """Count resources and missing tags per (Account, Service) in one chunk.
+
+    Args:
+        frame (pd.DataFrame): Inventory rows with the Account, Service and `tags` columns.
+        tags (list): Tag columns to check.
+
+    Returns:
+        pd.DataFrame: Resources and one missing count per tag, indexed by (Account, Service).
+    """
+    data = {column: frame[column].astype('category') for column in GROUP_COLUMNS}
+    data['Resources'] = np.ones(len(frame), dtype=np.int64)
+    for tag in tags:
+        # Boolean mask per required tag; summed by the groupby below
+        data[tag] = (frame[tag].astype('category') == MISSING_VALUE).to_numpy()
+    return pd.DataFrame(data).groupby(GROUP_COLUMNS, observed=True, sort=False).sum()
+
+
+def compliance_matrix(chunks, tags):
+    """Build the account x service x tag compliance matrix.
+
+    Args:
+        chunks (iterable): pd.DataFrame chunks of inventory rows.
+        tags (list): Tag columns to check.
+
+    Returns:
+        pd.DataFrame: Account, Service, Tag, Resources, Missing and CompliancePct columns.
+    """
+    partials = [count_missing(frame, tags) for frame in chunks if len(frame)]
+    columns = GROUP_COLUMNS + ['Tag', 'Resources', 'Missing', 'CompliancePct']
+    if not partials:
+        return pd.DataFrame(columns=columns)
+
+    totals = pd.concat(partials).groupby(level=GROUP_COLUMNS, observed=True).sum().reset_index()
+    # Chunks carry different categories: plain strings make the result independent of chunking
+    totals[GROUP_COLUMNS] = totals[GROUP_COLUMNS].astype(str)
+    matrix = totals.melt(id_vars=GROUP_COLUMNS + ['Resources'], value_vars=tags,
+                         var_name='Tag', value_name='Missing')
+    matrix['CompliancePct'] = (100 * (1 - matrix['Missing'] / matrix['Resources'])).round(1)
+    return matrix[columns].sort_values(GROUP_COLUMNS + ['Tag'], ignore_index=True)
+
+
+def iter_store_chunks(store, tags, chunksize=CHUNK_SIZE):
+    """Yield DataFrame chunks of the needed columns from an InventoryStore."""
+    columns = GROUP_COLUMNS + list(tags)
+    for batch in store.iter_columns(columns, chunksize):
+        yield pd.DataFrame.from_records(batch, columns=columns)
+
+
+def iter_csv_chunks(path, tags, chunksize=CHUNK_SIZE):
+    """Yield DataFrame chunks of the needed columns from a reportServices CSV (gzip or not)."""
+    # 'N/A' must stay a plain value, not be read as NaN
+    return pd.read_csv(path, usecols=GROUP_COLUMNS + list(tags), dtype='category',
+                       keep_default_na=False, chunksize=chunksize)
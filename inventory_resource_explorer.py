@@ -0,0 +1,112 @@
+"""Export the resources indexed by AWS Resource Explorer to CSV.
+
+The aggregator index, when the account has one, is queried alone: it already holds
+every region. Otherwise each region with a local index is queried concurrently.
+"""
+
+import csv
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import botocore.session
+
+from aws_clients import ClientFactory
+
+OUTPUT = os.environ.get('RESOURCE_EXPLORER_OUTPUT', "selected_regions_resources.csv")
+# Resource Explorer query ('*' for every resource)
+QUERY = os.environ.get('RESOURCE_EXPLORER_QUERY', "*")
+# Comma-separated regions queried when there is no aggregator; defaults to every region with a local index
+REGIONS = [r for r in os.environ.get('RESOURCE_EXPLORER_REGIONS', '').split(',') if r] or None
+# Number of regions queried in parallel when there is no aggregator
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '10'))
+
+HEADER = "ARN,Service,Region,LastReportedAt"
+
+_FACTORY = None
+_FACTORY_LOCK = threading.Lock()
+
+
+def get_client(service, region=None):
+    """Return a client whose timestamps are left as sent by the API (e.g. 2024-05-02T09:15:27.000Z),
+    so LastReportedAt is written exactly as the former jq script wrote it."""
+    global _FACTORY
+    with _FACTORY_LOCK:
+        if _FACTORY is None:
+            session = botocore.session.get_session()
+            session.get_component('response_parser_factory').set_parser_defaults(timestamp_parser=lambda value: value)
+            _FACTORY = ClientFactory(max_pool_connections=MAX_WORKERS, botocore_session=session)
+    return _FACTORY.client(service, region)
+
+
+def list_index_regions(index_type):
+    """Return the regions holding a Resource Explorer index of the given type (AGGREGATOR or LOCAL)."""
+    paginator = get_client('resource-explorer-2').get_paginator('list_indexes')
+    return [index['Region'] for page in paginator.paginate(Type=index_type) for index in page['Indexes']]
+
+
+def iter_resources(region, query=QUERY):
+    """Yield the resources of the index in one region, page by page.
+
+    list_resources has no result cap; search (limited to 1,000 results) is only used
+    when the installed botocore does not know list_resources yet.
+    """
+    client = get_client('resource-explorer-2', region)
+    if client.can_paginate('list_resources'):
+        kwargs = {} if query == "*" else {'Filters': {'FilterString': query}}
+        pages = client.get_paginator('list_resources').paginate(**kwargs)
+    else:
+        pages = client.get_paginator('search').paginate(QueryString=query)
+    for page in pages:
+        yield from page['Resources']
+
+
+def to_row(resource):
+    """CSV row of one resource: Arn, Service, Region, LastReportedAt."""
+    return (
+        resource['Arn'],
+        resource.get('Service', ''),
+        resource.get('Region', ''),
+        resource.get('LastReportedAt') or ''
+    )
+
+
+def collect_region_rows(region):
+    """Return every CSV row of the local index in one region."""
+    return [to_row(resource) for resource in iter_resources(region)]
+
+
+def main():
+    aggregator_regions = list_index_regions('AGGREGATOR')
+    count = 0
+
+    with open(OUTPUT, mode='w', newline='', encoding='utf-8') as file:
+        file.write(HEADER + "\n")
+        writer = csv.writer(file, quoting=csv.QUOTE_ALL, lineterminator="\n")
+
+        if aggregator_regions:
+            region = aggregator_regions[0]
+            print(f"Querying the aggregator index in {region}")
+            for resource in iter_resources(region):
+                writer.writerow(to_row(resource))
+                count += 1
+        else:
+            regions = REGIONS or sorted(list_index_regions('LOCAL'))
+            print(f"No aggregator index, querying {len(regions)} regions: {', '.join(regions)}")
+            with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+                futures = [executor.submit(collect_region_rows, region) for region in regions]
+                # Each region is written as soon as it is its turn, in region order
+                for region, future in zip(regions, futures):
+                    try:
+                        rows = future.result()
+                    except Exception as e:
+                        print(f"Error while querying {region}: {e}")
+                        continue
+                    writer.writerows(rows)
+                    count += len(rows)
+
+    print(f"Export done: {count} resources in {OUTPUT}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,46 +1,145 @@
-import boto3
+import argparse
 import csv
+import gzip
 import os
+import sys
+import threading
+from collections import Counter, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
 
-# Initialize AWS clients
-sts_client = boto3.client('sts')
-org_client = boto3.client('organizations')
+from aws_clients import get_client
+from aws_credentials import get_credentials
+from aws_regions import get_enabled_regions
+from aws_throttling import get_governor
+from inventory_store import DEFAULT_DB, InventoryStore
+
+# Number of (account, region) pairs scanned in parallel (override with the MAX_WORKERS env var)
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '10'))
+# Concurrent tagging API calls allowed per region, across all accounts, to stay under its throttling limits
+MAX_CONCURRENCY_PER_REGION = int(os.environ.get('MAX_CONCURRENCY_PER_REGION', '4'))
+# Comma-separated regions to scan; defaults to every region enabled in each account
+INVENTORY_REGIONS = [r for r in os.environ.get('INVENTORY_REGIONS', '').split(',') if r] or None
+# Write reportServices.csv.gz instead of reportServices.csv when set to 1
+INVENTORY_GZIP = os.environ.get('INVENTORY_GZIP', '0') == '1'
+
+# Report columns, in file order
+FIELDNAMES = (
+    'Service', 'Type', 'ResourceName', 'Name', 'Environment', 'Project',
+    'App', 'Owner', 'Critical_app', 'Critical_service', 'Backup_Daily',
+    'Backup_Monthly', 'StartStop', 'ARN', 'Account', 'Region'
+)
+# Tag key -> index of the report column it fills
+TAG_COLUMNS = {
+    'Name': 3, 'Environment': 4, 'Project': 5, 'App': 6, 'Owner': 7,
+    'Critical_app': 8, 'Critical_service': 9, 'backup_daily': 10,
+    'backup_monthly': 11, 'StartStop': 12
+}
+
+# Tag columns checked by the `compliance` subcommand (override with INVENTORY_REQUIRED_TAGS)
+REQUIRED_TAGS = [t for t in os.environ.get('INVENTORY_REQUIRED_TAGS', 'Owner,Environment,Backup_Daily').split(',') if t]
+
+# Columns indexed in the local snapshot, for fast `query` filters
+INDEXED_COLUMNS = ('Account', 'Service', 'Type') + tuple(FIELDNAMES[index] for index in TAG_COLUMNS.values())
+
+# One report row; a tuple subclass, so it carries no per-instance dict
+InventoryRow = namedtuple('InventoryRow', FIELDNAMES)
+
+_region_semaphores = {}
+_region_semaphores_lock = threading.Lock()
 
 def assume_role(account_id, role_name="AssumeRole_ReadOnlyAccess"):
-    """Assume a role in the given account and return temporary credentials."""
-    role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
-    assumed_role = sts_client.assume_role(
-        RoleArn=role_arn,
-        RoleSessionName="assumed-role-session"
-    )
-    return assumed_role['Credentials']
-
-def get_resource_tagging(credentials, resource_types):
-    """Retrieve tagged resources from the specified account using temporary credentials."""
-    tagging_client = boto3.client(
-        'resourcegroupstaggingapi',
-        aws_access_key_id=credentials['AccessKeyId'],
-        aws_secret_access_key=credentials['SecretAccessKey'],
-        aws_session_token=credentials['SessionToken'],
-        region_name='eu-west-1'
-    )
+    """Assume a role in the given account and return temporary credentials (cached until expiry)."""
+    return get_credentials(account_id, role_name, "assumed-role-session")
+
+def region_semaphore(region):
+    """Return the semaphore capping concurrent tagging API calls in a region."""
+    with _region_semaphores_lock:
+        if region not in _region_semaphores:
+            _region_semaphores[region] = threading.BoundedSemaphore(MAX_CONCURRENCY_PER_REGION)
+        return _region_semaphores[region]
+
+def get_resource_tagging(account_id, credentials, resource_types, region):
+    """Retrieve tagged resources from the specified account and region using temporary credentials."""
+    # Throttling is tracked per (service, region, account) by the shared governor
+    tagging_client = get_client('resourcegroupstaggingapi', region, account_id, credentials=credentials)
     resources = []
     paginator = tagging_client.get_paginator('get_resources')
-    for page in paginator.paginate(ResourceTypeFilters=resource_types):
-        resources.extend(page['ResourceTagMappingList'])
+    with region_semaphore(region):
+        for page in paginator.paginate(ResourceTypeFilters=resource_types):
+            resources.extend(page['ResourceTagMappingList'])
     return resources
 
 def get_all_accounts():
     """Retrieve all active AWS accounts in the organization."""
     accounts = []
-    paginator = org_client.get_paginator('list_accounts')
+    paginator = get_client('organizations').get_paginator('list_accounts')
     for page in paginator.paginate():
         for account in page['Accounts']:
             if account['Status'] == 'ACTIVE':
                 accounts.append(account['Id'])
     return accounts
 
-def main():
+def get_account_regions(account_id):
+    """Return the regions to scan in an account: its enabled regions, limited to INVENTORY_REGIONS if set."""
+    return get_enabled_regions(account_id, INVENTORY_REGIONS, session_name="assumed-role-session")
+
+def scan_account(account_id, resource_types, region):
+    """Assume the role in one account and return its tagged resources in one region."""
+    credentials = assume_role(account_id)
+    return get_resource_tagging(account_id, credentials, resource_types, region)
+
+def parse_resource(resource, account_id, region):
+    """Build the report row of one tagged resource, or None for snapshots."""
+    arn = resource['ResourceARN']
+    # Avoid snapshot resources
+    if "snapshot" in arn:
+        return None
+
+    # arn:partition:service:region:account:type[/name][:qualifier...], split once
+    parts = arn.split(":", 6)
+    row = ['N/A'] * len(FIELDNAMES)
+    row[0] = sys.intern(parts[2])
+    if len(parts) > 6:
+        # type:name[:...] -> the type column is only the repeating type prefix (db, function, log-group...)
+        row[1] = sys.intern(parts[5])
+    else:
+        # type/name or a bare name: unique per resource, interning would only grow the intern table
+        row[1] = parts[5] if len(parts) > 5 else 'N/A'
+    row[2] = arn.rpartition("/")[2]
+    for tag in resource.get('Tags', ()):
+        index = TAG_COLUMNS.get(tag['Key'])
+        if index is not None:
+            row[index] = tag['Value']
+    row[13] = arn
+    row[14] = sys.intern(account_id)
+    row[15] = region
+    return InventoryRow._make(row)
+
+def iter_in_order(executor, fn, tasks, window):
+    """Run fn(*task) for each task with at most `window` tasks in flight,
+    yielding (task, future) in task order."""
+    tasks = iter(tasks)
+    in_flight = deque()
+    for task in tasks:
+        in_flight.append((task, executor.submit(fn, *task)))
+        if len(in_flight) >= window:
+            yield in_flight.popleft()
+    while in_flight:
+        yield in_flight.popleft()
+
+def report_path(name):
+    """Return the path of a report file in the current working directory."""
+    return os.path.join(os.getcwd(), f"{name}.csv.gz" if INVENTORY_GZIP else f"{name}.csv")
+
+def open_report(file_path, gzipped=INVENTORY_GZIP):
+    """Open the report file for text writing, gzip-compressed if requested."""
+    if gzipped:
+        return gzip.open(file_path, mode='wt', newline='', encoding='utf-8')
+    return open(file_path, mode='w', newline='', encoding='utf-8')
+
+def scan(args):
+    """Scan the organization, write the full report and the changes since the previous snapshot."""
     resource_types = [
         "s3", "dynamodb", "cloudformation", "ecs", "elasticloadbalancing",
         "acm", "elasticache", "sns", "events", "lambda", "rds", "glacier",
@@ -49,48 +148,146 @@ def main():
     ]
 
     accounts = get_all_accounts()
-    report = []
-
-    for account_id in accounts:
-        credentials = assume_role(account_id)
-        resources = get_resource_tagging(credentials, resource_types)
-
-        for resource in resources:
-            arn = resource['ResourceARN']
-            tags = {tag['Key']: tag['Value'] for tag in resource.get('Tags', [])}
-
-            # Avoid snapshot resources
-            if "snapshot" not in arn:
-                report.append({
-                    'Account': account_id,
-                    'Service': arn.split(":")[2],
-                    'Type': arn.split(":")[5] if ":" in arn else 'N/A',
-                    'ResourceName': arn.split("/")[-1],
-                    'Name': tags.get('Name', 'N/A'),
-                    'Environment': tags.get('Environment', 'N/A'),
-                    'Project': tags.get('Project', 'N/A'),
-                    'App': tags.get('App', 'N/A'),
-                    'Owner': tags.get('Owner', 'N/A'),
-                    'Critical_app': tags.get('Critical_app', 'N/A'),
-                    'Critical_service': tags.get('Critical_service', 'N/A'),
-                    'Backup_Daily': tags.get('backup_daily', 'N/A'),
-                    'Backup_Monthly': tags.get('backup_monthly', 'N/A'),
-                    'StartStop': tags.get('StartStop', 'N/A'),
-                    'ARN': arn
-                })
-
-    # Write report to CSV file in the current working directory
-    file_path = os.path.join(os.getcwd(), "reportServices.csv")
-    with open(file_path, mode='w', newline='', encoding='utf-8') as file:
-        writer = csv.DictWriter(file, fieldnames=[
-            'Service', 'Type', 'ResourceName', 'Name', 'Environment', 'Project',
-            'App', 'Owner', 'Critical_app', 'Critical_service', 'Backup_Daily',
-            'Backup_Monthly', 'StartStop', 'ARN', 'Account'
-        ])
-        writer.writeheader()
-        writer.writerows(report)
-
-    print(f"Report generated and saved to {file_path}")
+    file_path = report_path("reportServices")
+    changes_path = report_path("reportServices_changes")
+    row_count = 0
+    change_counts = Counter()
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor, InventoryStore(FIELDNAMES, args.db, indexed=INDEXED_COLUMNS) as store, \
+            open_report(file_path) as file, open_report(changes_path) as changes_file:
+        region_futures = [executor.submit(get_account_regions, account_id) for account_id in accounts]
+        tasks = []
+        # Regions of each account in this run's scope, None when they could not be resolved
+        scopes = {}
+        for account_id, future in zip(accounts, region_futures):
+            scopes[account_id] = None
+            try:
+                scopes[account_id] = set(future.result())
+            except Exception as e:
+                print(f"Error while listing regions of account {account_id}: {e}")
+                continue
+            tasks.extend((account_id, region) for region in future.result())
+
+        writer = csv.writer(file)
+        writer.writerow(FIELDNAMES)
+        changes_writer = csv.writer(changes_file)
+        changes_writer.writerow(('Change',) + FIELDNAMES)
+
+        # Scan (account, region) pairs on one bounded pool and write each one's rows as soon as
+        # it is its turn: rows stay in account then region order, and only a window of
+        # results is held in memory
+        scans = iter_in_order(executor, lambda account_id, region: scan_account(account_id, resource_types, region),
+                              tasks, 2 * MAX_WORKERS)
+        for account_id, account_scans in groupby(scans, key=lambda scan_result: scan_result[0][0]):
+            account_rows = []
+            account_arns = set()
+            scanned_regions = []
+            for (_, region), future in account_scans:
+                try:
+                    resources = future.result()
+                except Exception as e:
+                    print(f"Error while scanning account {account_id} in {region}: {e}")
+                    continue
+
+                scanned_regions.append(region)
+                for resource in resources:
+                    row = parse_resource(resource, account_id, region)
+                    # A resource listed by several regions (e.g. global ones) is reported once
+                    if row is not None and row.ARN not in account_arns:
+                        account_arns.add(row.ARN)
+                        writer.writerow(row)
+                        account_rows.append(row)
+            row_count += len(account_rows)
+
+            # Regions that failed are left out: their stored resources are not reported as removed
+            for change, row in store.sync_account(account_id, scanned_regions, account_rows):
+                changes_writer.writerow((change,) + tuple(row))
+                change_counts[change] += 1
+
+        # Accounts that left the organization, and regions no longer enabled or selected
+        for change, row in store.prune(scopes):
+            changes_writer.writerow((change,) + tuple(row))
+            change_counts[change] += 1
+
+    print(f"Report generated and saved to {file_path} ({row_count} resources)")
+    print(f"Changes saved to {changes_path} ({change_counts['added']} added, "
+          f"{change_counts['removed']} removed, {change_counts['retagged']} retagged)")
+    print(get_governor().summary())
+
+def export(args):
+    """Regenerate the full report from the local snapshot, without calling AWS."""
+    file_path = report_path("reportServices")
+    row_count = 0
+    with InventoryStore(FIELDNAMES, args.db, indexed=INDEXED_COLUMNS) as store, open_report(file_path) as file:
+        writer = csv.writer(file)
+        writer.writerow(FIELDNAMES)
+        for row in store.iter_rows():
+            writer.writerow(row)
+            row_count += 1
+    print(f"Report exported from {args.db} to {file_path} ({row_count} resources)")
+
+def parse_filter(value):
+    """Parse a COLUMN=VALUE query filter."""
+    column, sep, expected = value.partition('=')
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected COLUMN=VALUE, got {value!r}")
+    return column, expected
+
+def query(args):
+    """Print the snapshot rows matching the filters as CSV, without calling AWS."""
+    with InventoryStore(FIELDNAMES, args.db, indexed=INDEXED_COLUMNS) as store:
+        try:
+            rows = store.query(dict(args.where), args.missing)
+        except ValueError as e:
+            sys.exit(f"Invalid query: {e}")
+        writer = csv.writer(sys.stdout)
+        writer.writerow(FIELDNAMES)
+        writer.writerows(rows)
+
+def compliance(args):
+    """Write the account x service x tag compliance matrix of the snapshot (or of a report CSV)."""
+    # pandas is only needed for this subcommand
+    from inventory_compliance import compliance_matrix, iter_csv_chunks, iter_store_chunks
+
+    tag_columns = [FIELDNAMES[index] for index in TAG_COLUMNS.values()]
+    unknown = [tag for tag in args.tags if tag not in tag_columns]
+    if unknown:
+        sys.exit(f"Unknown tag column(s) {', '.join(unknown)}, expected: {', '.join(tag_columns)}")
+
+    file_path = report_path("reportCompliance")
+    if args.csv:
+        matrix = compliance_matrix(iter_csv_chunks(args.csv, args.tags), args.tags)
+    else:
+        with InventoryStore(FIELDNAMES, args.db, indexed=INDEXED_COLUMNS) as store:
+            matrix = compliance_matrix(iter_store_chunks(store, args.tags), args.tags)
+    matrix.to_csv(file_path, index=False)
+    print(f"Compliance matrix saved to {file_path} ({len(matrix)} rows)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Inventory of the organization's resources and their tags.")
+    parser.add_argument('--db', default=DEFAULT_DB, help="SQLite snapshot of the inventory (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.add_parser('scan', help="Scan the organization (default)")
+    subparsers.add_parser('export', help="Write reportServices.csv from the snapshot, without calling AWS")
+    query_parser = subparsers.add_parser('query', help="Print matching snapshot rows as CSV, without calling AWS")
+    query_parser.add_argument('--where', type=parse_filter, action='append', default=[], metavar='COLUMN=VALUE',
+                              help="Keep rows where COLUMN equals VALUE (repeatable, e.g. Owner=team-a)")
+    query_parser.add_argument('--missing', action='append', default=[], metavar='COLUMN',
+                              help="Keep rows where the COLUMN tag is absent (repeatable, e.g. Owner)")
+    compliance_parser = subparsers.add_parser('compliance', help="Count missing required tags per account and service")
+    compliance_parser.add_argument('--tags', type=lambda value: value.split(','), default=REQUIRED_TAGS,
+                                   help="Comma-separated tag columns to check (default: %(default)s)")
+    compliance_parser.add_argument('--csv', help="Read this report CSV instead of the snapshot")
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export(args)
+    elif args.command == 'query':
+        query(args)
+    elif args.command == 'compliance':
+        compliance(args)
+    else:
+        scan(args)
 
 if __name__ == "__main__":
     main()
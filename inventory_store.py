@@ -0,0 +1,171 @@
+"""Local SQLite snapshot of the resource inventory, keyed by ARN."""
+
+import os
+import sqlite3
+
+# SQLite database holding the last inventory snapshot (override with the INVENTORY_DB env var)
+DEFAULT_DB = os.environ.get('INVENTORY_DB', os.path.join(os.getcwd(), "inventory.db"))
+
+ADDED = 'added'
+REMOVED = 'removed'
+RETAGGED = 'retagged'
+
+
+class InventoryStore:
+    """Keep the previous inventory snapshot and report what changed since.
+
+    Rows are tuples in `columns` order; `key` is the primary key column and each
+    row must also carry the `account` and `region` columns. An index is kept on
+    each of the `indexed` columns for query().
+    """
+
+    def __init__(self, columns, path=DEFAULT_DB, key='ARN', account='Account', region='Region', indexed=()):
+        self.columns = tuple(columns)
+        self._key_index = self.columns.index(key)
+        self._region_index = self.columns.index(region)
+        self._key, self._account, self._region = key, account, region
+        self._conn = sqlite3.connect(path)
+        self._select = ", ".join(f'"{column}"' for column in self.columns)
+        placeholders = ", ".join("?" * len(self.columns))
+        self._upsert = f"INSERT OR REPLACE INTO resources ({self._select}) VALUES ({placeholders})"
+        with self._conn:
+            self._conn.execute(f'CREATE TABLE IF NOT EXISTS resources ({self._select}, PRIMARY KEY ("{key}"))')
+            for column in indexed:
+                self._check_column(column)
+                self._conn.execute(f'CREATE INDEX IF NOT EXISTS "idx_resources_{column}" ON resources ("{column}")')
+
+    def _check_column(self, column):
+        if column not in self.columns:
+            raise ValueError(f"Unknown column {column!r}, expected one of: {', '.join(self.columns)}")
+
+    def sync_account(self, account_id, regions, rows):
+        """Replace the stored resources of one account in the given regions by `rows`,
+        in a single transaction.
+
+        Only `regions` are checked for removals: resources stored for other regions of the
+        account (e.g. a region whose scan failed this run) are kept and never reported as removed.
+        A key returned by several regions is kept once, from the first region listing it; a
+        resource that only moved to another region is updated without being reported.
+
+        Returns:
+            list: (change, row) pairs, change being ADDED, REMOVED or RETAGGED.
+        """
+        if not regions:
+            return []
+        with self._conn:
+            previous = {
+                row[self._key_index]: row
+                for row in self._conn.execute(
+                    f'SELECT {self._select} FROM resources WHERE "{self._account}" = ?', (account_id,)
+                )
+            }
+            seen = set()
+            # Only new or modified rows are written: an unchanged row would be deleted and
+            # reinserted by INSERT OR REPLACE, with every index updated
+            upserts = []
+            changes = []
+            for row in rows:
+                key = row[self._key_index]
+                if key in seen:
+                    continue
+                seen.add(key)
+                old = previous.pop(key, None)
+                if old is None:
+                    changes.append((ADDED, row))
+                elif self._without_region(old) != self._without_region(row):
+                    changes.append((RETAGGED, row))
+                elif tuple(old) == tuple(row):
+                    continue
+                upserts.append(row)
+            scanned = set(regions)
+            removed = [row for row in previous.values() if row[self._region_index] in scanned]
+            changes.extend((REMOVED, row) for row in removed)
+
+            self._conn.executemany(self._upsert, upserts)
+            self._delete(removed)
+        return changes
+
+    def prune(self, scopes):
+        """Remove the stored resources outside the scanned scope, in a single transaction.
+
+        Args:
+            scopes (dict): {account_id: regions}; accounts missing from it (left or closed) lose
+                all their resources, the others keep only those in `regions`. None as regions
+                keeps every resource of the account (e.g. its regions could not be resolved).
+
+        Returns:
+            list: (REMOVED, row) pairs.
+        """
+        with self._conn:
+            stale = [
+                (account_id, region)
+                for account_id, region in self._conn.execute(
+                    f'SELECT DISTINCT "{self._account}", "{self._region}" FROM resources'
+                )
+                if account_id not in scopes or (scopes[account_id] is not None and region not in scopes[account_id])
+            ]
+            removed = []
+            for account_id, region in stale:
+                removed.extend(self._conn.execute(
+                    f'SELECT {self._select} FROM resources WHERE "{self._account}" = ? AND "{self._region}" = ?',
+                    (account_id, region)
+                ))
+            self._delete(removed)
+        return [(REMOVED, row) for row in removed]
+
+    def _without_region(self, row):
+        return tuple(value for index, value in enumerate(row) if index != self._region_index)
+
+    def _delete(self, rows):
+        self._conn.executemany(f'DELETE FROM resources WHERE "{self._key}" = ?',
+                               ((row[self._key_index],) for row in rows))
+
+    def iter_rows(self):
+        """Yield every stored row, ordered by account, region and key."""
+        return self._conn.execute(
+            f'SELECT {self._select} FROM resources ORDER BY "{self._account}", "{self._region}", "{self._key}"'
+        )
+
+    def iter_columns(self, columns, batch_size=100000):
+        """Yield the stored values of `columns` in lists of at most `batch_size` tuples."""
+        for column in columns:
+            self._check_column(column)
+        select = ", ".join(f'"{column}"' for column in columns)
+        cursor = self._conn.execute(f'SELECT {select} FROM resources')
+        while True:
+            batch = cursor.fetchmany(batch_size)
+            if not batch:
+                return
+            yield batch
+
+    def query(self, where=None, missing=(), missing_value='N/A'):
+        """Yield the stored rows matching every filter, ordered like iter_rows().
+
+        Args:
+            where (dict): {column: value} equality filters.
+            missing (iterable): Columns that must hold `missing_value` (e.g. untagged).
+            missing_value (str): Value the inventory uses for an absent tag.
+        """
+        conditions, params = [], []
+        for column, value in (where or {}).items():
+            self._check_column(column)
+            conditions.append(f'"{column}" = ?')
+            params.append(value)
+        for column in missing:
+            self._check_column(column)
+            conditions.append(f'"{column}" = ?')
+            params.append(missing_value)
+        sql = f'SELECT {self._select} FROM resources'
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += f' ORDER BY "{self._account}", "{self._region}", "{self._key}"'
+        return self._conn.execute(sql, params)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
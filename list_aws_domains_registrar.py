@@ -3,13 +3,16 @@
 
 import csv
 from datetime import datetime, timezone
-import boto3
 from botocore.exceptions import (
     ClientError,
     ParamValidationError,
     NoCredentialsError,
     PartialCredentialsError)
 
+from aws_clients import get_client
+from aws_credentials import get_credentials, get_provider
+from aws_throttling import get_governor
+
 # Nom du rôle à assumer dans chaque compte
 ASSUME_ROLE_NAME = "AssumeRole_ReadOnlyAccess"
 
@@ -23,21 +26,12 @@ def assume_role(account_id, role_name):
     Fonction pour assumer un rôle IAM dans un compte donné afin
     d'obtenir des credentials temporaires pour appeler Route53Domains.
     """
-    sts = boto3.client("sts")
-    role_arn = f"arn:aws:iam::{account_id}:role/{role_name}"
     try:
-        creds = sts.assume_role(
-            RoleArn=role_arn,
-            RoleSessionName="ListDomainsSession"
-        )["Credentials"]
-
-        return boto3.client(
-            "route53domains",
-            region_name="us-east-1",  # Service global, exposé uniquement ici
-            aws_access_key_id=creds["AccessKeyId"],
-            aws_secret_access_key=creds["SecretAccessKey"],
-            aws_session_token=creds["SessionToken"],
-        )
+        # Credentials partagés, réutilisés tant qu'ils ne sont pas proches de l'expiration
+        creds = get_credentials(account_id, role_name, "ListDomainsSession")
+
+        # Service global, exposé uniquement en us-east-1
+        return get_client("route53domains", "us-east-1", account_id, credentials=creds)
     except (ClientError, ParamValidationError, NoCredentialsError, PartialCredentialsError) as e:
         print(f"[{account_id}] Impossible d'assumer le rôle: {e}")
         return None
@@ -75,7 +69,7 @@ def main():
     Fonction principale : parcourt tous les comptes de l’organisation,
     récupère la liste des domaines enregistrés et exporte le résultat en CSV.
     """
-    org = boto3.client("organizations")
+    org = get_client("organizations")
     accounts = []
 
     # Pagination pour récupérer tous les comptes
@@ -85,7 +79,8 @@ def main():
 
     all_domains = []
 
-    for acc in accounts:
+    for acc in get_provider().iter_with_prefetch(accounts, ASSUME_ROLE_NAME, "ListDomainsSession",
+                                                 key=lambda a: a["Id"]):
         account_id = acc["Id"]
         print(f"🔎 Traitement du compte {account_id} ({acc['Name']})")
         all_domains.extend(list_domains_for_account(account_id))
@@ -98,6 +93,7 @@ def main():
         writer.writerows(all_domains)
 
     print(f"\n✅ Export terminé : {OUTPUT_FILE}")
+    print(get_governor().summary())
 
 
 if __name__ == "__main__":
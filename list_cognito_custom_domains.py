@@ -1,11 +1,19 @@
 """Module listant les customs domains pour une organisation"""
 
+from concurrent.futures import ThreadPoolExecutor
+
 import boto3
 
+from aws_clients import get_client
+from aws_credentials import get_credentials
+from aws_regions import get_enabled_regions
+
 # --- Config ---
 ROLE_NAME = "AssumeRole_ReadOnlyAccess"  # rôle à assumer dans chaque compte
 MAX_RESULTS = 60
-REGION_LIST = ["eu-west-1", "eu-west-3", "us-east-1"]  # None pour auto-lister toutes les régions
+REGION_LIST = ["eu-west-1", "eu-west-3", "us-east-1"]  # restreint aux régions activées de chaque compte, None pour toutes
+MAX_WORKERS = 10  # couples (compte, région) scannés en parallèle
+MAX_POOL_WORKERS = 10  # appels describe_user_pool menés en parallèle, tous comptes confondus
 
 # --- Fonctions ---
 def list_accounts():
@@ -16,13 +24,19 @@ def list_accounts():
     for page in paginator.paginate():
          for acc in page["Accounts"]:
             if acc["Status"] == "ACTIVE":  # Ignorer comptes désactivés
-                accounts.append(acc)dan
+                accounts.append(acc)
     return accounts
 
-def list_regions():
-    """Fonction pour obtenir la liste de toutes les régions AWS disponibles."""
-    ec2 = boto3.client("ec2")
-    return [r["RegionName"] for r in ec2.describe_regions()["Regions"]]
+def list_regions(account_id):
+    """Fonction pour obtenir les régions activées d'un compte, restreintes à REGION_LIST si défini.
+
+    Args:
+        account_id (str): ID du compte AWS.
+
+    Returns:
+        list: Régions à scanner pour ce compte.
+    """
+    return get_enabled_regions(account_id, REGION_LIST, role_name=ROLE_NAME, session_name="CognitoDomainScan")
 
 def assume_role(account_id):
     """Fonction pour assumer un rôle dans un compte donné et obtenir des credentials temporaires.
@@ -33,10 +47,7 @@ def assume_role(account_id):
     Returns:
         dict: Credentials temporaires (AccessKeyId, SecretAccessKey, SessionToken)
     """
-    sts_client = boto3.client("sts")
-    role_arn = f"arn:aws:iam::{account_id}:role/{ROLE_NAME}"
-    resp = sts_client.assume_role(RoleArn=role_arn, RoleSessionName="CognitoDomainScan")
-    return resp["Credentials"]
+    return get_credentials(account_id, ROLE_NAME, "CognitoDomainScan")
 
 def get_cognito_client(region, credentials):
     """Fonction pour créer un client Cognito IDP avec des credentials temporaires.
@@ -48,13 +59,7 @@ def get_cognito_client(region, credentials):
     Returns:
         boto3.client: Client Cognito IDP
     """
-    return boto3.client(
-        "cognito-idp",
-        region_name=region,
-        aws_access_key_id=credentials["AccessKeyId"],
-        aws_secret_access_key=credentials["SecretAccessKey"],
-        aws_session_token=credentials["SessionToken"]
-    )
+    return get_client("cognito-idp", region, credentials=credentials)
 
 def list_user_pools(cognito_client):
     """Fonction pour lister tous les User Pools d'un client Cognito dans une région.
@@ -71,51 +76,71 @@ def list_user_pools(cognito_client):
         pools.extend(page["UserPools"])
     return pools
 
-def get_custom_domain(cognito_client, pool_id):
-    """Fonction pour récupérer le custom domain d'un User Pool.
+def get_user_pool_domains(cognito_client, pool_id):
+    """Fonction pour récupérer le domaine Cognito et le custom domain d'un User Pool.
+
+    Un seul appel describe_user_pool suffit : les champs `Domain` et `CustomDomain`
+    y sont renseignés, sans passer par describe_user_pool_domain.
 
     Args:
         cognito_client (boto3.client): Client Cognito IDP.
         pool_id (str): ID du User Pool.
 
     Returns:
-        str|None: Nom du custom domain si présent, sinon None.
+        tuple: (préfixe de domaine Cognito ou None, custom domain ou None)
+    """
+    pool = cognito_client.describe_user_pool(UserPoolId=pool_id)["UserPool"]
+    return pool.get("Domain"), pool.get("CustomDomain")
+
+def scan_region(account, region, pool_executor):
+    """Fonction pour lister les User Pools d'un compte dans une région, avec leurs domaines.
+
+    Args:
+        account (dict): Compte AWS (Id, Name).
+        region (str): Région AWS.
+        pool_executor (ThreadPoolExecutor): Pool borné partagé pour les describe_user_pool.
+
+    Returns:
+        list: Une ligne par User Pool.
     """
-    try:
-        response = cognito_client.describe_user_pool_domain(Domain=pool_id)
-        return response.get("DomainDescription", {}).get("Domain")
-    except cognito_client.exceptions.ResourceNotFoundException:
-        return None
+    cognito_client = get_cognito_client(region, assume_role(account["Id"]))
+    pools = list_user_pools(cognito_client)
+    domains = pool_executor.map(lambda pool: get_user_pool_domains(cognito_client, pool["Id"]), pools)
+    return [{
+        "AccountId": account["Id"],
+        "AccountName": account["Name"],
+        "Region": region,
+        "UserPoolId": pool["Id"],
+        "UserPoolName": pool["Name"],
+        "Domain": domain,
+        "CustomDomain": custom_domain
+    } for pool, (domain, custom_domain) in zip(pools, domains)]
 
 # --- Script principal ---
 def main():
     """Fonction principale pour parcourir tous les comptes et régions, lister les User Pools et leurs Custom Domains."""
     accounts = list_accounts()
-    regions = REGION_LIST if REGION_LIST else list_regions()
     result = []
 
-    for account in accounts:
-        account_id = account["Id"]
-        account_name = account["Name"]
-        print(f"\nScanning account {account_id} ({account_name})")
-        creds = assume_role(account_id)
-
-        for region in regions:
-            print(f"  Region: {region}")
-            cognito_client = get_cognito_client(region, creds)
-            pools = list_user_pools(cognito_client)
-            for pool in pools:
-                pool_id = pool["Id"]
-                pool_name = pool["Name"]
-                # domain = get_custom_domain(cognito_client, pool_id)
-                result.append({
-                    "AccountId": account_id,
-                    "AccountName": account_name,
-                    "Region": region,
-                    "UserPoolId": pool_id,
-                    "UserPoolName": pool_name,
-                    # "CustomDomain": domain
-                })
+    with ThreadPoolExecutor(max_workers=MAX_POOL_WORKERS) as pool_executor, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # Régions activées de chaque compte, résolues en parallèle (et en cache disque)
+        region_futures = [executor.submit(list_regions, account["Id"]) for account in accounts]
+        tasks = []
+        for account, future in zip(accounts, region_futures):
+            try:
+                tasks.extend((account, region) for region in future.result())
+            except Exception as e:
+                print(f"  Error listing regions for account {account['Id']} ({account['Name']}): {e}")
+
+        print(f"Scanning {len(accounts)} accounts, {len(tasks)} account/region pairs")
+        futures = [executor.submit(scan_region, account, region, pool_executor) for account, region in tasks]
+        # Résultats repris dans l'ordre comptes x régions
+        for (account, region), future in zip(tasks, futures):
+            try:
+                result.extend(future.result())
+            except Exception as e:
+                print(f"  Error for account {account['Id']} ({account['Name']}) in {region}: {e}")
 
     # --- Affichage ---
     print("\nUser Pools with Custom Domains:")
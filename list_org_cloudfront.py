@@ -1,12 +1,14 @@
-import boto3
 import csv
 
+from aws_clients import get_client
+from aws_credentials import get_credentials, get_provider
+from aws_throttling import get_governor
+
 # Nom du rôle à assumer dans chaque compte
 ROLE_NAME = "AssumeRole_ReadOnlyAccess"
 
-# Clients initiaux (dans le compte management)
-org_client = boto3.client("organizations")
-sts_client = boto3.client("sts")
+# Client initial (dans le compte management)
+org_client = get_client("organizations")
 
 # Récupérer tous les comptes actifs de l’organisation
 accounts = []
@@ -24,23 +26,14 @@ with open("OrgCloudfront_distributions.csv", "w", newline="") as csvfile:
     writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
     writer.writeheader()
 
-    for account_id in accounts:
+    for account_id in get_provider().iter_with_prefetch(accounts, ROLE_NAME, "ListCloudFront"):
         print(f"=== Compte {account_id} ===")
         try:
-            # Assumer le rôle dans le compte cible
-            role_arn = f"arn:aws:iam::{account_id}:role/{ROLE_NAME}"
-            creds = sts_client.assume_role(
-                RoleArn=role_arn,
-                RoleSessionName="ListCloudFront"
-            )["Credentials"]
+            # Assumer le rôle dans le compte cible (credentials mis en cache)
+            creds = get_credentials(account_id, ROLE_NAME, "ListCloudFront")
 
             # Créer client CloudFront avec credentials du compte
-            cf_client = boto3.client(
-                "cloudfront",
-                aws_access_key_id=creds["AccessKeyId"],
-                aws_secret_access_key=creds["SecretAccessKey"],
-                aws_session_token=creds["SessionToken"],
-            )
+            cf_client = get_client("cloudfront", account_id=account_id, credentials=creds)
 
             # Lister les distributions
             paginator = cf_client.get_paginator("list_distributions")
@@ -57,3 +50,5 @@ with open("OrgCloudfront_distributions.csv", "w", newline="") as csvfile:
         except Exception as e:
             print(f"Erreur dans le compte {account_id}: {e}")
 
+# Temps passé à attendre le débit autorisé et les retries
+print(get_governor().summary())
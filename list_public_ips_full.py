@@ -1,225 +1,299 @@
 import boto3
 import csv
+import os
+import queue
+import threading
+import time
 
-# Créer une session AWS par défaut (basée sur les variables d'environnement)
-def get_default_session():
-    session = boto3.Session()
-    return session
+from aws_clients import get_client
+
+# Délai maximal (en secondes) accordé à chaque collecteur pour un compte
+COLLECTOR_TIMEOUT = int(os.environ.get('COLLECTOR_TIMEOUT', '60'))
+# Nombre maximal d'IPs en attente d'écriture (borne la mémoire)
+QUEUE_SIZE = 1000
+# Mode de collecte : 'full' (un appel par service) ou 'fast' (scan unique des interfaces réseau)
+SCAN_MODE = os.environ.get('PUBLIC_IPS_MODE', 'full')
+
+# Parcourir toutes les pages d'un appel API, avec ou sans paginator boto3
+def paginate(client, method, result_key, **kwargs):
+    if client.can_paginate(method):
+        for page in client.get_paginator(method).paginate(**kwargs):
+            yield from page.get(result_key, [])
+        return
+    while True:
+        response = getattr(client, method)(**kwargs)
+        yield from response.get(result_key, [])
+        token = response.get('NextToken')
+        if not token:
+            break
+        kwargs['NextToken'] = token
 
 # Récupérer la liste des comptes dans l'organisation AWS
 def get_accounts():
     org_client = boto3.client('organizations')
-    response = org_client.list_accounts()
-    return response['Accounts']
+    return list(paginate(org_client, 'list_accounts', 'Accounts'))
 
 # Récupérer les adresses IP publiques des instances EC2
 def get_ec2_public_ips(ec2_client):
-    ips = []
-    response = ec2_client.describe_instances()
-    for reservation in response['Reservations']:
+    for reservation in paginate(ec2_client, 'describe_instances', 'Reservations'):
         for instance in reservation['Instances']:
             if 'PublicIpAddress' in instance:
-                ips.append({
+                yield {
                     'Type': 'EC2',
                     'ResourceId': instance['InstanceId'],
                     'PublicIP': instance['PublicIpAddress']
-                })
-    return ips
+                }
 
 # Récupérer les Elastic IPs
 def get_elastic_ips(ec2_client):
-    ips = []
-    response = ec2_client.describe_addresses()
-    for address in response['Addresses']:
+    for address in paginate(ec2_client, 'describe_addresses', 'Addresses'):
         if 'PublicIp' in address:
-            ips.append({
+            yield {
                 'Type': 'Elastic IP',
                 'ResourceId': address['AllocationId'],
                 'PublicIP': address['PublicIp']
-            })
-    return ips
+            }
 
 # Récupérer les NAT Gateways et leurs IPs
 def get_nat_gateway_ips(ec2_client):
-    ips = []
-    response = ec2_client.describe_nat_gateways()
-    for nat_gateway in response['NatGateways']:
+    for nat_gateway in paginate(ec2_client, 'describe_nat_gateways', 'NatGateways'):
         for address in nat_gateway.get('NatGatewayAddresses', []):
             if 'PublicIp' in address:
-                ips.append({
+                yield {
                     'Type': 'NAT Gateway',
                     'ResourceId': nat_gateway['NatGatewayId'],
                     'PublicIP': address['PublicIp']
-                })
-    return ips
+                }
 
 # Récupérer les IPs des Classic Load Balancers (ELB)
 def get_classic_elb_ips(elb_client):
-    ips = []
-    response = elb_client.describe_load_balancers()
-    for load_balancer in response['LoadBalancerDescriptions']:
-        ips.append({
+    for load_balancer in paginate(elb_client, 'describe_load_balancers', 'LoadBalancerDescriptions'):
+        yield {
             'Type': 'Classic Load Balancer',
             'ResourceId': load_balancer['LoadBalancerName'],
             'PublicIP': load_balancer['DNSName']
-        })
-    return ips
+        }
 
 # Récupérer les IPs des Application/Network Load Balancers (ELBv2)
 def get_elbv2_ips(elbv2_client):
-    ips = []
-    response = elbv2_client.describe_load_balancers()
-    for load_balancer in response['LoadBalancers']:
+    for load_balancer in paginate(elbv2_client, 'describe_load_balancers', 'LoadBalancers'):
         if 'DNSName' in load_balancer:
-            ips.append({
+            yield {
                 'Type': 'Application/Network Load Balancer',
                 'ResourceId': load_balancer['LoadBalancerArn'],
                 'PublicIP': load_balancer['DNSName']
-            })
-    return ips
+            }
 
 # Récupérer les IPs des instances RDS
 def get_rds_ips(rds_client):
-    ips = []
-    response = rds_client.describe_db_instances()
-    for db_instance in response['DBInstances']:
+    for db_instance in paginate(rds_client, 'describe_db_instances', 'DBInstances'):
         if 'Endpoint' in db_instance and 'Address' in db_instance['Endpoint']:
-            ips.append({
+            yield {
                 'Type': 'RDS',
                 'ResourceId': db_instance['DBInstanceIdentifier'],
                 'PublicIP': db_instance['Endpoint']['Address']
-            })
-    return ips
+            }
 
 # Récupérer les IPs des instances DocumentDB
 def get_docdb_ips(docdb_client):
-    ips = []
-    response = docdb_client.describe_db_instances()
-    for db_instance in response['DBInstances']:
+    for db_instance in paginate(docdb_client, 'describe_db_instances', 'DBInstances'):
         if 'Endpoint' in db_instance and 'Address' in db_instance['Endpoint']:
-            ips.append({
+            yield {
                 'Type': 'DocumentDB',
                 'ResourceId': db_instance['DBInstanceIdentifier'],
                 'PublicIP': db_instance['Endpoint']['Address']
-            })
-    return ips
+            }
 
 # Récupérer les IPs des clusters ElastiCache
 def get_elasticache_ips(elasticache_client):
-    ips = []
-    response = elasticache_client.describe_cache_clusters(ShowCacheNodeInfo=True)
-    for cluster in response['CacheClusters']:
+    for cluster in paginate(elasticache_client, 'describe_cache_clusters', 'CacheClusters', ShowCacheNodeInfo=True):
         for node in cluster['CacheNodes']:
             if 'Endpoint' in node and 'Address' in node['Endpoint']:
-                ips.append({
+                yield {
                     'Type': 'ElastiCache',
                     'ResourceId': cluster['CacheClusterId'],
                     'PublicIP': node['Endpoint']['Address']
-                })
-    return ips
+                }
 
 # Récupérer les IPs des instances Lightsail
 def get_lightsail_ips(lightsail_client):
-    ips = []
-    response = lightsail_client.get_instances()
-    for instance in response['instances']:
+    for instance in paginate(lightsail_client, 'get_instances', 'instances'):
         if 'publicIpAddress' in instance:
-            ips.append({
+            yield {
                 'Type': 'Lightsail',
                 'ResourceId': instance['name'],
                 'PublicIP': instance['publicIpAddress']
-            })
-    return ips
+            }
 
 # Récupérer les IPs des API Gateway
 def get_apigateway_ips(apigateway_client):
-    ips = []
-    response = apigateway_client.get_rest_apis()
-    for api in response['items']:
-        ips.append({
+    for api in paginate(apigateway_client, 'get_rest_apis', 'items'):
+        yield {
             'Type': 'API Gateway',
             'ResourceId': api['id'],
             'PublicIP': api['id'] + ".execute-api.amazonaws.com"  # API Gateway DNS
-        })
-    return ips
+        }
 
 # Récupérer les IPs des distributions CloudFront
 def get_cloudfront_ips(cloudfront_client):
-    ips = []
-    response = cloudfront_client.list_distributions()
-    if 'DistributionList' in response:
-        for distribution in response['DistributionList'].get('Items', []):
-            ips.append({
+    for page in cloudfront_client.get_paginator('list_distributions').paginate():
+        for distribution in page.get('DistributionList', {}).get('Items', []):
+            yield {
                 'Type': 'CloudFront',
                 'ResourceId': distribution['Id'],
                 'PublicIP': distribution['DomainName']
-            })
-    return ips
+            }
 
 # Récupérer les IPs des services App Runner
 def get_apprunner_ips(apprunner_client):
-    ips = []
-    response = apprunner_client.list_services()
-    for service in response['ServiceSummaryList']:
-        ips.append({
+    for service in paginate(apprunner_client, 'list_services', 'ServiceSummaryList'):
+        yield {
             'Type': 'App Runner',
             'ResourceId': service['ServiceArn'],
             'PublicIP': service['ServiceUrl']
-        })
-    return ips
+        }
 
 # Récupérer les IPs des clusters EKS
 def get_eks_ips(eks_client):
-    ips = []
-    response = eks_client.list_clusters()
-    for cluster_name in response['clusters']:
+    for cluster_name in paginate(eks_client, 'list_clusters', 'clusters'):
         cluster_info = eks_client.describe_cluster(name=cluster_name)
         if 'endpoint' in cluster_info['cluster']:
-            ips.append({
+            yield {
                 'Type': 'EKS',
                 'ResourceId': cluster_name,
                 'PublicIP': cluster_info['cluster']['endpoint']
-            })
-    return ips
+            }
+
+# Retrouver la ressource propriétaire d'une interface réseau (type, identifiant)
+def get_eni_owner(interface):
+    interface_type = interface.get('InterfaceType', 'interface')
+    requester_id = interface.get('RequesterId', '')
+    description = interface.get('Description', '')
+    instance_id = interface.get('Attachment', {}).get('InstanceId')
+
+    if instance_id:
+        return 'EC2', instance_id
+    if interface_type == 'nat_gateway':
+        # Description : "Interface for NAT Gateway nat-xxxxxxxx"
+        return 'NAT Gateway', description.rsplit(' ', 1)[-1]
+    if description.startswith(('ELB app/', 'ELB net/')) or interface_type == 'network_load_balancer':
+        # Description : "ELB app/<nom>/<id>" ou "ELB net/<nom>/<id>"
+        return 'Application/Network Load Balancer', description[len('ELB '):]
+    if description.startswith('ELB '):
+        return 'Classic Load Balancer', description[len('ELB '):]
+    if requester_id == 'amazon-elasticache':
+        # Description : "ElastiCache <cluster-id>"
+        return 'ElastiCache', description.rsplit(' ', 1)[-1]
+    if requester_id == 'amazon-rds':
+        # RDS et DocumentDB partagent le même demandeur, sans identifiant dans la description
+        return 'RDS/DocumentDB', interface['NetworkInterfaceId']
+    return f"ENI ({interface_type})", description or interface['NetworkInterfaceId']
+
+# Récupérer en un seul scan toutes les IPs publiques portées par une interface réseau
+# (EC2, Elastic IPs associées, NAT Gateways, ELB/ALB/NLB, RDS, DocumentDB, ElastiCache).
+# Les Elastic IPs non associées ne sont pas remontées par ce scan.
+def get_eni_public_ips(ec2_client):
+    filters = [{'Name': 'association.public-ip', 'Values': ['*']}]
+    for interface in paginate(ec2_client, 'describe_network_interfaces', 'NetworkInterfaces', Filters=filters):
+        resource_type, resource_id = get_eni_owner(interface)
+        yield {
+            'Type': resource_type,
+            'ResourceId': resource_id,
+            'PublicIP': interface['Association']['PublicIp']
+        }
+
+# Table des collecteurs : (type de ressource, service boto3, fonction de collecte)
+COLLECTORS = [
+    ('EC2', 'ec2', get_ec2_public_ips),
+    ('Elastic IP', 'ec2', get_elastic_ips),
+    ('NAT Gateway', 'ec2', get_nat_gateway_ips),
+    ('Classic Load Balancer', 'elb', get_classic_elb_ips),
+    ('Application/Network Load Balancer', 'elbv2', get_elbv2_ips),
+    ('RDS', 'rds', get_rds_ips),
+    ('DocumentDB', 'docdb', get_docdb_ips),
+    ('ElastiCache', 'elasticache', get_elasticache_ips),
+    ('Lightsail', 'lightsail', get_lightsail_ips),
+    ('API Gateway', 'apigateway', get_apigateway_ips),
+    ('CloudFront', 'cloudfront', get_cloudfront_ips),
+    ('App Runner', 'apprunner', get_apprunner_ips),
+    ('EKS', 'eks', get_eks_ips),
+]
 
-# Lister toutes les adresses IP publiques dans chaque compte
+# Mode rapide : le scan des interfaces réseau remplace les collecteurs EC2, EIP, NAT, ELB, RDS,
+# DocumentDB et ElastiCache ; les services hors VPC gardent leur collecteur
+FAST_COLLECTORS = [
+    ('Network Interfaces', 'ec2', get_eni_public_ips),
+    ('Lightsail', 'lightsail', get_lightsail_ips),
+    ('API Gateway', 'apigateway', get_apigateway_ips),
+    ('CloudFront', 'cloudfront', get_cloudfront_ips),
+    ('App Runner', 'apprunner', get_apprunner_ips),
+    ('EKS', 'eks', get_eks_ips),
+]
+
+# Lister toutes les adresses IP publiques dans chaque compte, au fil de l'eau
 def list_public_ips_for_account():
-    session = get_default_session()
-
-    ec2_client = session.client('ec2')
-    elb_client = session.client('elb')
-    elbv2_client = session.client('elbv2')
-    rds_client = session.client('rds')
-    docdb_client = session.client('docdb')
-    elasticache_client = session.client('elasticache')
-    lightsail_client = session.client('lightsail')
-    apigateway_client = session.client('apigateway')
-    cloudfront_client = session.client('cloudfront')
-    apprunner_client = session.client('apprunner')
-    eks_client = session.client('eks')
-
-    ips = []
-    ips.extend(get_ec2_public_ips(ec2_client))
-    ips.extend(get_elastic_ips(ec2_client))
-    ips.extend(get_nat_gateway_ips(ec2_client))
-    ips.extend(get_classic_elb_ips(elb_client))
-    ips.extend(get_elbv2_ips(elbv2_client))
-    ips.extend(get_rds_ips(rds_client))
-    ips.extend(get_docdb_ips(docdb_client))
-    ips.extend(get_elasticache_ips(elasticache_client))
-    ips.extend(get_lightsail_ips(lightsail_client))
-    ips.extend(get_apigateway_ips(apigateway_client))
-    ips.extend(get_cloudfront_ips(cloudfront_client))
-    ips.extend(get_apprunner_ips(apprunner_client))
-    ips.extend(get_eks_ips(eks_client))
-
-    return ips
+    collectors = FAST_COLLECTORS if SCAN_MODE == 'fast' else COLLECTORS
+
+    # Clients réutilisés d'un compte à l'autre par la fabrique partagée
+    clients = {service: get_client(service) for _, service, _ in collectors}
+
+    # Les collecteurs sont indépendants : chacun tourne dans son thread et pousse
+    # ses résultats page par page dans une file bornée
+    results = queue.Queue(maxsize=QUEUE_SIZE)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def run(name, collector, client):
+        try:
+            for ip_info in collector(client):
+                if not put(ip_info):
+                    return
+        except Exception as e:
+            put({'Type': name, 'ResourceId': 'ERREUR', 'PublicIP': str(e)})
+        finally:
+            put(name)
+
+    pending = set()
+    for name, service, collector in collectors:
+        pending.add(name)
+        # Threads démons : un appel bloqué ne retient pas la fin du script
+        threading.Thread(target=run, args=(name, collector, clients[service]), daemon=True).start()
+
+    deadline = time.monotonic() + COLLECTOR_TIMEOUT
+    try:
+        while pending:
+            try:
+                item = results.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                # Les collecteurs trop lents sont signalés sans perdre ce qui a déjà été écrit
+                for name in sorted(pending):
+                    yield {
+                        'Type': name,
+                        'ResourceId': 'TIMEOUT',
+                        'PublicIP': f"Délai de {COLLECTOR_TIMEOUT}s dépassé"
+                    }
+                break
+            if isinstance(item, str):
+                pending.discard(item)
+            else:
+                yield item
+    finally:
+        stop.set()
 
 # Liste des comptes dans votre organisation
 accounts = get_accounts()
 
 # Fichier de sortie
-with open('public_ips.csv', 'w', newline='') as csvfile:
+# Fichier écrit ligne par ligne : les premières IPs sont sur disque dès leur collecte
+with open('public_ips.csv', 'w', newline='', buffering=1) as csvfile:
     fieldnames = ['AccountId', 'AccountName', 'ResourceType', 'ResourceId', 'PublicIP']
     writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
     writer.writeheader()
@@ -232,8 +306,7 @@ with open('public_ips.csv', 'w', newline='') as csvfile:
         try:
             # Récupérer les IP publiques pour ce compte
             print(f"Récupération des IPs pour le compte {account_name} ({account_id})...")
-            account_ips = list_public_ips_for_account()
-            for ip_info in account_ips:
+            for ip_info in list_public_ips_for_account():
                 writer.writerow({
                     'AccountId': account_id,
                     'AccountName': account_name,
@@ -1,126 +1,118 @@
 import boto3
 import csv
+from itertools import chain
+
+from aws_clients import get_client
+
+# Parcourir toutes les pages d'un appel API, avec ou sans paginator boto3
+def paginate(client, method, result_key, **kwargs):
+    """Parcourir toutes les pages d'un appel API"""
+    if client.can_paginate(method):
+        for page in client.get_paginator(method).paginate(**kwargs):
+            yield from page.get(result_key, [])
+        return
+    while True:
+        response = getattr(client, method)(**kwargs)
+        yield from response.get(result_key, [])
+        token = response.get('NextToken')
+        if not token:
+            break
+        kwargs['NextToken'] = token
 
 # Récupérer la liste des comptes dans l'organisation AWS
 def get_accounts():
     org_client = boto3.client('organizations')
-    response = org_client.list_accounts()
-    return response['Accounts']
-
-# Créer une session AWS par défaut (basée sur les variables d'environnement)
-def get_default_session():
-    session = boto3.Session()
-    return session
+    return list(paginate(org_client, 'list_accounts', 'Accounts'))
 
 # Récupérer les adresses IP publiques des instances EC2
 def get_ec2_public_ips(ec2_client):
-    ips = []
-    response = ec2_client.describe_instances()
-    for reservation in response['Reservations']:
+    for reservation in paginate(ec2_client, 'describe_instances', 'Reservations'):
         for instance in reservation['Instances']:
             if 'PublicIpAddress' in instance:
-                ips.append({
+                yield {
                     'Type': 'EC2',
                     'ResourceId': instance['InstanceId'],
                     'PublicIP': instance['PublicIpAddress']
-                })
-    return ips
+                }
 
 # Récupérer les Elastic IPs
 def get_elastic_ips(ec2_client):
     """Récupérer les Elastic IPs"""
-    ips = []
-    response = ec2_client.describe_addresses()
-    for address in response['Addresses']:
+    for address in paginate(ec2_client, 'describe_addresses', 'Addresses'):
         if 'PublicIp' in address:
-            ips.append({
+            yield {
                 'Type': 'Elastic IP',
                 'ResourceId': address['AllocationId'],
                 'PublicIP': address['PublicIp']
-            })
-    return ips
+            }
 
 # Récupérer les NAT Gateways et leurs IPs
 def get_nat_gateway_ips(ec2_client):
     """Récupérer les IPs des NAT Gateways"""
-    ips = []
-    response = ec2_client.describe_nat_gateways()
-    for nat_gateway in response['NatGateways']:
+    for nat_gateway in paginate(ec2_client, 'describe_nat_gateways', 'NatGateways'):
         for address in nat_gateway.get('NatGatewayAddresses', []):
             if 'PublicIp' in address:
-                ips.append({
+                yield {
                     'Type': 'NAT Gateway',
                     'ResourceId': nat_gateway['NatGatewayId'],
                     'PublicIP': address['PublicIp']
-                })
-    return ips
+                }
 
 # Récupérer les IPs des Classic Load Balancers (ELB)
 def get_classic_elb_ips(elb_client):
     """Récupérer les IPs des Classic Load Balancers (ELB)"""
-    ips = []
-    response = elb_client.describe_load_balancers()
-    for load_balancer in response['LoadBalancerDescriptions']:
-        ips.append({
+    for load_balancer in paginate(elb_client, 'describe_load_balancers', 'LoadBalancerDescriptions'):
+        yield {
             'Type': 'Classic Load Balancer',
             'ResourceId': load_balancer['LoadBalancerName'],
             'PublicIP': load_balancer['DNSName']  # DNS Name is used to resolve public IPs
-        })
-    return ips
+        }
 
 # Récupérer les IPs des Application/Network Load Balancers (ELBv2)
 def get_elbv2_ips(elbv2_client):
     """Récupérer les IPs des Application/Network Load Balancers (ELBv2)"""
-    ips = []
-    response = elbv2_client.describe_load_balancers()
-    for load_balancer in response['LoadBalancers']:
+    for load_balancer in paginate(elbv2_client, 'describe_load_balancers', 'LoadBalancers'):
         if 'DNSName' in load_balancer:
-            ips.append({
+            yield {
                 'Type': 'Application/Network Load Balancer',
                 'ResourceId': load_balancer['LoadBalancerArn'],
                 'PublicIP': load_balancer['DNSName']  # DNS Name is used to resolve public IPs
-            })
-    return ips
+            }
 
 # Récupérer les IPs des instances DocumentDB
 def get_docdb_ips(docdb_client):
     """Récupérer les IPs des instances DocumentDB"""
-    ips = []
-    response = docdb_client.describe_db_instances()
-    for db_instance in response['DBInstances']:
+    for db_instance in paginate(docdb_client, 'describe_db_instances', 'DBInstances'):
         if 'Endpoint' in db_instance and 'Address' in db_instance['Endpoint']:
-            ips.append({
+            yield {
                 'Type': 'DocumentDB',
                 'ResourceId': db_instance['DBInstanceIdentifier'],
                 'PublicIP': db_instance['Endpoint']['Address']  # DNS Name used to resolve IP
-            })
-    return ips
+            }
 
 # Lister toutes les adresses IP publiques dans chaque compte
 def list_public_ips_for_account():
-    """Récupérer les adresses IP publiques pour un compte AWS"""
-    session = get_default_session()
-
-    ec2_client = session.client('ec2')
-    elb_client = session.client('elb')
-    elbv2_client = session.client('elbv2')
-    docdb_client = session.client('docdb')
-
-    ips = []
-    ips.extend(get_ec2_public_ips(ec2_client))
-    ips.extend(get_elastic_ips(ec2_client))
-    ips.extend(get_nat_gateway_ips(ec2_client))
-    ips.extend(get_classic_elb_ips(elb_client))
-    ips.extend(get_elbv2_ips(elbv2_client))
-    ips.extend(get_docdb_ips(docdb_client))
-
-    return ips
+    """Récupérer les adresses IP publiques pour un compte AWS, page par page"""
+    ec2_client = get_client('ec2')
+    elb_client = get_client('elb')
+    elbv2_client = get_client('elbv2')
+    docdb_client = get_client('docdb')
+
+    return chain(
+        get_ec2_public_ips(ec2_client),
+        get_elastic_ips(ec2_client),
+        get_nat_gateway_ips(ec2_client),
+        get_classic_elb_ips(elb_client),
+        get_elbv2_ips(elbv2_client),
+        get_docdb_ips(docdb_client),
+    )
 
 # Liste des comptes dans votre organisation
 accounts = get_accounts()
 
 # Fichier de sortie
-with open('public_ips.csv', 'w', newline='') as csvfile:
+# Fichier écrit ligne par ligne : les premières IPs sont sur disque dès leur collecte
+with open('public_ips.csv', 'w', newline='', buffering=1) as csvfile:
     fieldnames = ['AccountId', 'ResourceType', 'ResourceId', 'PublicIP']
     writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
     writer.writeheader()
@@ -133,8 +125,7 @@ with open('public_ips.csv', 'w', newline='') as csvfile:
         try:
             # Récupérer les IP publiques pour ce compte
             print(f"Récupération des IPs pour le compte {account_name} ({account_id})...")
-            account_ips = list_public_ips_for_account()
-            for ip_info in account_ips:
+            for ip_info in list_public_ips_for_account():
                 writer.writerow({
                     'AccountId': account_id,
                     'ResourceType': ip_info['Type'],
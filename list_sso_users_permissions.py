@@ -1,10 +1,27 @@
-"""Module listant les privilèges des comptes du AWS Identity Center"""
+"""Module listant les privilèges des comptes du AWS Identity Center
 
+Usage :
+    python list_sso_users_permissions.py                 # rapport complet
+    python list_sso_users_permissions.py --user <nom|email>  # accès d'un seul utilisateur
+"""
+
+import argparse
 import csv
+import heapq
+import os
 import sys
-from collections import defaultdict
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date
-import boto3
+
+from aws_clients import get_client
+from aws_throttling import get_governor
+
+# Nombre d'appels SSO Admin / Identity Store menés en parallèle
+MAX_WORKERS = 10
+# Nombre maximal de lignes triées en mémoire ; au-delà, les blocs triés sont déversés sur disque
+MAX_ROWS_IN_MEMORY = int(os.environ.get("SSO_REPORT_MAX_ROWS_IN_MEMORY", "500000"))
 
 
 def paginate(method, result_key, **kwargs):
@@ -19,10 +36,47 @@ def paginate(method, result_key, **kwargs):
             break
         kwargs["NextToken"] = token
 
+CSV_HEADER = [
+    "UserName", "UserId", "DisplayName", "Email",
+    "AccountId", "AccountName",
+    "PermissionSetName", "PermissionSetArn",
+    "AssignmentType", "GroupName"
+]
+
+
+def user_info(u):
+    """UserName, DisplayName et email principal d'un utilisateur de l'Identity Store"""
+    emails = u.get("Emails") or []
+    email = ""
+    if emails:
+        prim = [e for e in emails if e.get("Primary")]
+        email = (prim[0] if prim else emails[0]).get("Value", "")
+    return {
+        "UserName": u.get("UserName") or "",
+        "DisplayName": u.get("DisplayName") or "",
+        "Email": email
+    }
+
+
+def group_name(g):
+    """Nom affiché d'un groupe de l'Identity Store"""
+    return g.get("DisplayName") or g.get("ExternalIds", [{}])[0].get("Id", "") or g["GroupId"]
+
 # ---------- Clients ----------
-sso_admin = boto3.client("sso-admin")
-identitystore = boto3.client("identitystore")
-org = boto3.client("organizations")
+# Clients partagés et régulés (débit adaptatif et retries en cas de throttling)
+sso_admin = get_client("sso-admin")
+identitystore = get_client("identitystore")
+org = get_client("organizations")
+
+# Pool dédié aux appels SSO Admin ; executor.map conserve l'ordre des tâches,
+# la sortie est donc identique à celle d'un parcours séquentiel
+task_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+
+
+def describe_permission_set_name(ps_arn):
+    """Nom d'un permission set"""
+    d = sso_admin.describe_permission_set(InstanceArn=INSTANCE_ARN, PermissionSetArn=ps_arn)
+    return d["PermissionSet"]["Name"]
 
 # ---------- Discover instance ----------
 instances = sso_admin.list_instances().get("Instances", [])
@@ -34,6 +88,90 @@ instance = instances[0]
 INSTANCE_ARN = instance["InstanceArn"]
 IDENTITY_STORE_ID = instance["IdentityStoreId"]
 
+# ---------- Requête ciblée sur un utilisateur ----------
+def find_user_id(identifier):
+    """UserId d'un utilisateur à partir de son UserName ou de son email"""
+    attribute_path = "emails.value" if "@" in identifier else "userName"
+    resp = identitystore.get_user_id(
+        IdentityStoreId=IDENTITY_STORE_ID,
+        AlternateIdentifier={"UniqueAttribute": {"AttributePath": attribute_path, "AttributeValue": identifier}}
+    )
+    return resp["UserId"]
+
+def list_principal_assignments(principal):
+    """Attributions d'un principal (USER ou GROUP), tous comptes confondus"""
+    principal_type, principal_id = principal
+    return list(paginate(
+        sso_admin.list_account_assignments_for_principal,
+        "AccountAssignments",
+        InstanceArn=INSTANCE_ARN,
+        PrincipalId=principal_id,
+        PrincipalType=principal_type
+    ))
+
+def describe_group_name(gid):
+    """Nom d'un groupe"""
+    return group_name(identitystore.describe_group(IdentityStoreId=IDENTITY_STORE_ID, GroupId=gid))
+
+def describe_account_name(acct_id):
+    """Nom d'un compte de l'organisation"""
+    try:
+        return org.describe_account(AccountId=acct_id)["Account"].get("Name", "")
+    except org.exceptions.AccountNotFoundException:
+        return ""
+
+def query_user(identifier):
+    """Lignes d'accès (directes et via groupes) d'un seul utilisateur, sans parcourir toute l'organisation"""
+    try:
+        uid = find_user_id(identifier)
+    except identitystore.exceptions.ResourceNotFoundException:
+        print(f"Utilisateur introuvable : {identifier}", file=sys.stderr)
+        sys.exit(1)
+    uinfo = user_info(identitystore.describe_user(IdentityStoreId=IDENTITY_STORE_ID, UserId=uid))
+
+    gids = [gm["GroupId"] for gm in paginate(
+        identitystore.list_group_memberships_for_member,
+        "GroupMemberships",
+        IdentityStoreId=IDENTITY_STORE_ID,
+        MemberId={"UserId": uid}
+    )]
+    principals = [("USER", uid)] + [("GROUP", gid) for gid in gids]
+
+    # Les attributions et les noms (groupes, permission sets, comptes) sont résolus en parallèle
+    group_names = dict(zip(gids, task_pool.map(describe_group_name, gids)))
+    assignments = list(task_pool.map(list_principal_assignments, principals))
+    ps_arns = sorted({asg["PermissionSetArn"] for asgs in assignments for asg in asgs})
+    acct_ids = sorted({asg["AccountId"] for asgs in assignments for asg in asgs})
+    ps_names = dict(zip(ps_arns, task_pool.map(describe_permission_set_name, ps_arns)))
+    acct_names = dict(zip(acct_ids, task_pool.map(describe_account_name, acct_ids)))
+
+    rows = []
+    for (principal_type, principal_id), asgs in zip(principals, assignments):
+        for asg in asgs:
+            rows.append([
+                uinfo["UserName"],
+                uid,
+                uinfo["DisplayName"],
+                uinfo["Email"],
+                asg["AccountId"],
+                acct_names[asg["AccountId"]],
+                ps_names[asg["PermissionSetArn"]],
+                asg["PermissionSetArn"],
+                "DIRECT" if principal_type == "USER" else "GROUP",
+                group_names.get(principal_id, "")
+            ])
+    return rows
+
+parser = argparse.ArgumentParser(description="Privilèges des utilisateurs du AWS Identity Center")
+parser.add_argument("--user", help="UserName ou email : n'affiche que les accès de cet utilisateur")
+args = parser.parse_args()
+
+if args.user:
+    w = csv.writer(sys.stdout)
+    w.writerow(CSV_HEADER)
+    w.writerows(query_user(args.user))
+    sys.exit(0)
+
 # ---------- Accounts (Organizations) ----------
 accounts = {}
 for acct in paginate(org.list_accounts, "Accounts"):
@@ -42,67 +180,84 @@ for acct in paginate(org.list_accounts, "Accounts"):
 # ---------- Users ----------
 users = {}
 for u in paginate(identitystore.list_users, "Users", IdentityStoreId=IDENTITY_STORE_ID):
-    user_id = u["UserId"]
-    user_name = u.get("UserName") or ""
-    display = u.get("DisplayName") or ""
-    emails = u.get("Emails") or []
-    EMAIL = ""
-    if emails:
-        prim = [e for e in emails if e.get("Primary")]
-        EMAIL = (prim[0] if prim else emails[0]).get("Value", "")
-    users[user_id] = {
-        "UserName": user_name,
-        "DisplayName": display,
-        "Email": EMAIL
-    }
+    users[u["UserId"]] = user_info(u)
 
-# ---------- Groups & membership ----------
+# ---------- Groups ----------
 groups = {}
-group_members = defaultdict(set)
 
 for g in paginate(identitystore.list_groups, "Groups", IdentityStoreId=IDENTITY_STORE_ID):
-    gid = g["GroupId"]
-    gname = g.get("DisplayName") or g.get("ExternalIds", [{}])[0].get("Id", "") or gid
-    groups[gid] = gname
+    groups[g["GroupId"]] = group_name(g)
 
+# ---------- Membership (à la demande) ----------
+def fetch_group_members(gid):
+    """Membres (UserId) d'un groupe"""
+    members = set()
     for gm in paginate(identitystore.list_group_memberships, "GroupMemberships",
                        IdentityStoreId=IDENTITY_STORE_ID, GroupId=gid):
         member = gm.get("MemberId", {})
         uid = member.get("UserId")
         if uid:
-            group_members[gid].add(uid)
+            members.add(uid)
+    return members
+
+# Seuls les groupes réellement assignés sont résolus, une seule fois chacun
+membership_pool = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+group_members = {}
+group_members_lock = threading.Lock()
+
+def request_group_members(gid):
+    """Lance la récupération des membres d'un groupe (mémoïsée)"""
+    with group_members_lock:
+        if gid not in group_members:
+            group_members[gid] = membership_pool.submit(fetch_group_members, gid)
+        return group_members[gid]
 
 # ---------- Permission sets ----------
 ps_arns = list(paginate(sso_admin.list_permission_sets, "PermissionSets", InstanceArn=INSTANCE_ARN))
 
-ps_names = {}
-for ps_arn in ps_arns:
-    d = sso_admin.describe_permission_set(InstanceArn=INSTANCE_ARN, PermissionSetArn=ps_arn)
-    ps_names[ps_arn] = d["PermissionSet"]["Name"]
+ps_names = dict(zip(ps_arns, task_pool.map(describe_permission_set_name, ps_arns)))
 
 # ---------- Collecte des attributions ----------
-rows = []
-
-for ps_arn in ps_arns:
-    ps_name = ps_names[ps_arn]
-
-    for acct_id in paginate(
+def list_provisioned_accounts(ps_arn):
+    """Comptes sur lesquels un permission set est provisionné"""
+    return list(paginate(
         sso_admin.list_accounts_for_provisioned_permission_set,
         "AccountIds",
         InstanceArn=INSTANCE_ARN,
         PermissionSetArn=ps_arn,
         ProvisioningStatus="LATEST_PERMISSION_SET_PROVISIONED",  # <-- fix
-    ):
-        acct_name = accounts.get(acct_id, "")
+    ))
+
+def list_assignments(task):
+    """Attributions d'un couple (permission set, compte)"""
+    ps_arn, acct_id = task
+    assignments = list(paginate(
+        sso_admin.list_account_assignments,
+        "AccountAssignments",
+        InstanceArn=INSTANCE_ARN,
+        AccountId=acct_id,
+        PermissionSetArn=ps_arn
+    ))
+
+    # Les membres des groupes assignés sont récupérés en arrière-plan
+    for asg in assignments:
+        if asg["PrincipalType"] == "GROUP":
+            request_group_members(asg["PrincipalId"])
+    return assignments
+
+# File de tâches (permission set, compte), dans l'ordre du parcours séquentiel
+ps_accounts = task_pool.map(list_provisioned_accounts, ps_arns)
+tasks = [(ps_arn, acct_id) for ps_arn, acct_ids in zip(ps_arns, ps_accounts) for acct_id in acct_ids]
 
-        assignments = list(paginate(
-            sso_admin.list_account_assignments,
-            "AccountAssignments",
-            InstanceArn=INSTANCE_ARN,
-            AccountId=acct_id,
-            PermissionSetArn=ps_arn
-        ))
+collected = [
+    (ps_arn, ps_names[ps_arn], acct_id, accounts.get(acct_id, ""), assignments)
+    for (ps_arn, acct_id), assignments in zip(tasks, task_pool.map(list_assignments, tasks))
+]
 
+# ---------- Expansion des attributions ----------
+def expand_rows():
+    """Une ligne par utilisateur et par attribution (directe ou via un groupe)"""
+    for ps_arn, ps_name, acct_id, acct_name, assignments in collected:
         for asg in assignments:
             principal_type = asg["PrincipalType"]  # USER | GROUP
             principal_id = asg["PrincipalId"]
@@ -110,7 +265,7 @@ for ps_arn in ps_arns:
             if principal_type == "USER":
                 if principal_id in users:
                     uinfo = users[principal_id]
-                    rows.append([
+                    yield [
                         uinfo["UserName"],
                         principal_id,
                         uinfo["DisplayName"],
@@ -121,9 +276,9 @@ for ps_arn in ps_arns:
                         ps_arn,
                         "DIRECT",
                         ""
-                    ])
+                    ]
                 else:
-                    rows.append([
+                    yield [
                         "",  # UserName inconnu
                         principal_id,
                         "",
@@ -134,14 +289,14 @@ for ps_arn in ps_arns:
                         ps_arn,
                         "DIRECT",
                         ""
-                    ])
+                    ]
 
             elif principal_type == "GROUP":
                 gname = groups.get(principal_id, principal_id)
-                member_ids = group_members.get(principal_id, set())
+                member_ids = request_group_members(principal_id).result()
                 for uid in member_ids:
                     uinfo = users.get(uid, {"UserName": "", "DisplayName": "", "Email": ""})
-                    rows.append([
+                    yield [
                         uinfo["UserName"],
                         uid,
                         uinfo["DisplayName"],
@@ -152,10 +307,41 @@ for ps_arn in ps_arns:
                         ps_arn,
                         "GROUP",
                         gname
-                    ])
+                    ]
 
-# ---------- Tri par UserName ----------
-rows.sort(key=lambda r: r[0] or "")
+# ---------- Tri par UserName (tri externe) ----------
+def sort_key(row):
+    """Clé de tri : UserName"""
+    return row[0] or ""
+
+def spill_chunk(chunk):
+    """Écrit un bloc trié dans un fichier temporaire et le rembobine"""
+    tmp = tempfile.TemporaryFile(mode="w+", newline="", encoding="utf-8")
+    csv.writer(tmp).writerows(chunk)
+    tmp.seek(0)
+    return tmp
+
+def sorted_rows(rows, max_rows_in_memory=MAX_ROWS_IN_MEMORY):
+    """Trie les lignes par blocs bornés puis les fusionne (k-way merge).
+
+    Le tri de chaque bloc et heapq.merge sont stables : le résultat est identique
+    à un tri en mémoire de toutes les lignes.
+    """
+    spilled = []
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= max_rows_in_memory:
+            chunk.sort(key=sort_key)
+            spilled.append(spill_chunk(chunk))
+            chunk = []
+    chunk.sort(key=sort_key)
+
+    try:
+        yield from heapq.merge(*(csv.reader(tmp) for tmp in spilled), chunk, key=sort_key)
+    finally:
+        for tmp in spilled:
+            tmp.close()
 
 # ---------- Nom du fichier avec date ----------
 today_str = date.today().strftime("%Y%m%d")
@@ -164,12 +350,11 @@ OUT_FILE = f"{today_str}_identity_center_users_permissions.csv"
 # ---------- Sortie CSV ----------
 with open(OUT_FILE, "w", newline="", encoding="utf-8") as f:
     w = csv.writer(f)
-    w.writerow([
-        "UserName", "UserId", "DisplayName", "Email",
-        "AccountId", "AccountName",
-        "PermissionSetName", "PermissionSetArn",
-        "AssignmentType", "GroupName"
-    ])
-    w.writerows(rows)
-
-print(f"OK -> {OUT_FILE} ({len(rows)} lignes)")
+    w.writerow(CSV_HEADER)
+    row_count = 0
+    for row in sorted_rows(expand_rows()):
+        w.writerow(row)
+        row_count += 1
+
+print(f"OK -> {OUT_FILE} ({row_count} lignes)")
+print(get_governor().summary())
@@ -1,85 +1,394 @@
-import boto3
 import csv
+import gzip
+import io
 import os
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
 import tempfile
 import json
 
-ORG_CLIENT = boto3.client('organizations')
-SNS_TOPIC_ARN = os.environ['SNS_TOPIC_ARN']
+from aws_clients import get_client
+from aws_credentials import get_credentials
+from aws_regions import get_enabled_regions
+
+# Aucun client n'est créé à l'import : ils le sont à la première invocation puis réutilisés
+# (credentials STS et clients régionaux) par les invocations à chaud du même conteneur
 ROLE_NAME = os.environ.get('ROLE_NAME', 'AssumeRole_ReadOnlyAccess')
 UNSUPPORTED_RUNTIMES = ['python3.9', 'python3.8', 'python3.7', 'python3.6', 'python3.5', 'python3.4']
-REGIONS = ['eu-west-1', 'eu-west-3', 'eu-north-1', 'us-east-1']  # Add more as needed
+# Régions auditées (séparées par des virgules) ; par défaut toutes les régions activées de chaque compte
+REGIONS = [r for r in os.environ.get('REGIONS', '').split(',') if r] or None
+MAX_WORKERS = int(os.environ.get('MAX_WORKERS', '10'))
+# Temps (ms) gardé avant le timeout de la fonction pour sauvegarder la progression et se relancer
+DEADLINE_MARGIN_MS = int(os.environ.get('DEADLINE_MARGIN_MS', '60000'))
+# Temps (ms) toujours gardé pour sauvegarder et se relancer, même en attendant le premier shard de l'invocation
+CHECKPOINT_RESERVE_MS = int(os.environ.get('CHECKPOINT_RESERVE_MS', '10000'))
+# Checkpoint sur S3 si un bucket est fourni, sinon dans un fichier local (tests, exécution hors Lambda).
+# Le /tmp d'un conteneur n'est pas partagé avec celui qui traite la relance : sans CHECKPOINT_BUCKET,
+# la fonction ne se relance pas d'elle-même et la reprise se fait à la main avec {'resume': true}
+CHECKPOINT_BUCKET = os.environ.get('CHECKPOINT_BUCKET')
+CHECKPOINT_KEY = os.environ.get('CHECKPOINT_KEY', 'lambda-audit/checkpoint.json')
+CHECKPOINT_FILE = os.environ.get('CHECKPOINT_FILE', os.path.join(tempfile.gettempdir(), 'lambda-audit-checkpoint.json'))
+# Agrégateur AWS Config d'organisation : une seule requête remplace le parcours compte par compte
+CONFIG_AGGREGATOR_NAME = os.environ.get('CONFIG_AGGREGATOR_NAME')
+# Durée (s) pendant laquelle la liste des comptes actifs est réutilisée entre invocations à chaud
+ACCOUNTS_CACHE_TTL = int(os.environ.get('ACCOUNTS_CACHE_TTL', '900'))
+_ACCOUNTS_CACHE = {'accounts': None, 'expires_at': 0.0}
+# Rapport CSV (gzip) déposé sur S3 ; REPORT_BUCKET est lu à l'envoi du rapport
+REPORT_PREFIX = os.environ.get('REPORT_PREFIX', 'lambda-audit/')
+# Validité (s) demandée pour le lien présigné. Signé avec les credentials temporaires du rôle de la
+# fonction, le lien cesse de fonctionner à l'expiration de leur session (quelques heures au plus),
+# quelle que soit cette valeur : 1h par défaut, une durée que la session couvre sûrement
+REPORT_URL_EXPIRES = int(os.environ.get('REPORT_URL_EXPIRES', '3600'))
+# Endpoint S3 alternatif (stand-in local pour les tests, ex: moto ou MinIO)
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL')
+CSV_FIELDNAMES = ['AccountName', 'AccountId', 'FunctionName', 'Runtime', 'ARN']
 
 def assume_role(account_id):
-    sts = boto3.client('sts')
-    role_arn = f"arn:aws:iam::{account_id}:role/{ROLE_NAME}"
-    response = sts.assume_role(RoleArn=role_arn, RoleSessionName='LambdaAudit')
-    creds = response['Credentials']
-    return creds
+    return get_credentials(account_id, ROLE_NAME, 'LambdaAudit')
 
-def list_lambdas_for_account(account_id, account_name):
+def list_lambdas_for_region(account_id, account_name, region):
     lambdas_info = []
     creds = assume_role(account_id)
-    for region in REGIONS:
-        lambda_client = boto3.client(
-            'lambda',
-            region_name=region,
-            aws_access_key_id=creds['AccessKeyId'],
-            aws_secret_access_key=creds['SecretAccessKey'],
-            aws_session_token=creds['SessionToken']
-        )
-        paginator = lambda_client.get_paginator('list_functions')
-        for page in paginator.paginate():
-            for func in page['Functions']:
-                runtime = func.get('Runtime', '')
-                if runtime in UNSUPPORTED_RUNTIMES:
-                    lambdas_info.append({
-                        'AccountName': account_name,
-                        'AccountId': account_id,
-                        'FunctionName': func['FunctionName'],
-                        'Runtime': runtime,
-                        'ARN': func['FunctionArn']
-                    })
+    lambda_client = get_client('lambda', region, account_id, credentials=creds)
+    paginator = lambda_client.get_paginator('list_functions')
+    for page in paginator.paginate():
+        for func in page['Functions']:
+            runtime = func.get('Runtime', '')
+            if runtime in UNSUPPORTED_RUNTIMES:
+                lambdas_info.append({
+                    'AccountName': account_name,
+                    'AccountId': account_id,
+                    'FunctionName': func['FunctionName'],
+                    'Runtime': runtime,
+                    'ARN': func['FunctionArn']
+                })
+    return lambdas_info
+
+def get_account_regions(account_id):
+    # Régions activées du compte (cache disque partagé entre invocations à chaud), restreintes à REGIONS si fourni
+    return get_enabled_regions(account_id, REGIONS, role_name=ROLE_NAME, session_name='LambdaAudit')
+
+def list_lambdas_from_config(aggregator_name, accounts):
+    """Liste les fonctions aux runtimes obsolètes de toute l'organisation (toutes régions)
+    via une requête avancée sur un agrégateur AWS Config."""
+    account_names = {acct['Id']: acct['Name'] for acct in accounts}
+    runtimes = ", ".join(f"'{runtime}'" for runtime in UNSUPPORTED_RUNTIMES)
+    expression = (
+        "SELECT accountId, resourceName, arn, configuration.runtime "
+        "WHERE resourceType = 'AWS::Lambda::Function' "
+        f"AND configuration.runtime IN ({runtimes})"
+    )
+    config_client = get_client('config')
+    kwargs = {'Expression': expression, 'ConfigurationAggregatorName': aggregator_name, 'Limit': 100}
+    lambdas_info = []
+    while True:
+        response = config_client.select_aggregate_resource_config(**kwargs)
+        for result in response['Results']:
+            item = json.loads(result)
+            # Mêmes comptes que le parcours compte par compte : uniquement les comptes actifs
+            if item['accountId'] not in account_names:
+                continue
+            lambdas_info.append({
+                'AccountName': account_names[item['accountId']],
+                'AccountId': item['accountId'],
+                'FunctionName': item['resourceName'],
+                'Runtime': item['configuration']['runtime'],
+                'ARN': item['arn']
+            })
+        if not response.get('NextToken'):
+            break
+        kwargs['NextToken'] = response['NextToken']
     return lambdas_info
 
 def get_active_accounts():
-    paginator = ORG_CLIENT.get_paginator('list_accounts')
+    if _ACCOUNTS_CACHE['accounts'] is not None and time.monotonic() < _ACCOUNTS_CACHE['expires_at']:
+        return _ACCOUNTS_CACHE['accounts']
+
+    paginator = get_client('organizations').get_paginator('list_accounts')
     accounts = []
     for page in paginator.paginate():
         for acct in page['Accounts']:
             if acct['Status'] == 'ACTIVE':
                 accounts.append({'Id': acct['Id'], 'Name': acct['Name']})
+    _ACCOUNTS_CACHE['accounts'] = accounts
+    _ACCOUNTS_CACHE['expires_at'] = time.monotonic() + ACCOUNTS_CACHE_TTL
     return accounts
 
-def lambda_handler(event, context):
+class LocalCheckpointStore:
+    """Checkpoint dans un fichier local (tests, exécution hors Lambda)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self, state):
+        with open(self.path, 'w') as f:
+            json.dump(state, f)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class S3CheckpointStore:
+    """Checkpoint dans un objet S3, partagé entre les invocations successives."""
+
+    def __init__(self, bucket, key):
+        self.bucket = bucket
+        self.key = key
+        self.s3 = get_s3_client()
+
+    def load(self):
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.key)
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    def save(self, state):
+        self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=json.dumps(state).encode('utf-8'))
+
+    def clear(self):
+        self.s3.delete_object(Bucket=self.bucket, Key=self.key)
+
+def get_s3_client():
+    return get_client('s3', endpoint_url=S3_ENDPOINT_URL)
+
+class S3MultipartWriter:
+    """Fichier binaire en écriture seule envoyé sur S3 par upload multipart, au fil de l'eau.
+
+    Seule une part (PART_SIZE octets) est gardée en mémoire. En cas d'exception dans le bloc
+    `with`, l'upload est annulé au lieu d'être complété.
+    """
+
+    # Taille minimale imposée par S3 pour toutes les parts sauf la dernière : 5 Mio
+    PART_SIZE = 8 * 1024 * 1024
+
+    def __init__(self, s3, bucket, key, part_size=PART_SIZE, content_type='application/gzip'):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.parts = []
+        self.buffer = bytearray()
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, ContentType=content_type)['UploadId']
+
+    def write(self, data):
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.part_size:
+            self._upload_part(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self, body):
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=body
+        )
+        self.parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+
+    def close(self):
+        # La dernière part peut être plus petite que 5 Mio
+        if self.buffer or not self.parts:
+            self._upload_part(bytes(self.buffer))
+            self.buffer.clear()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={'Parts': self.parts}
+        )
+
+    def abort(self):
+        self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def get_checkpoint_store():
+    if CHECKPOINT_BUCKET:
+        return S3CheckpointStore(CHECKPOINT_BUCKET, CHECKPOINT_KEY)
+    return LocalCheckpointStore(CHECKPOINT_FILE)
+
+def new_audit_state():
     accounts = get_active_accounts()
-    results = []
-    for account in accounts:
-        results.extend(list_lambdas_for_account(account['Id'], account['Name']))
+    if CONFIG_AGGREGATOR_NAME:
+        try:
+            return {
+                'pending': [],
+                'results': list_lambdas_from_config(CONFIG_AGGREGATOR_NAME, accounts),
+                'errors': []
+            }
+        except Exception as e:
+            # Repli sur le parcours compte par compte
+            print(f"Requête sur l'agrégateur Config {CONFIG_AGGREGATOR_NAME} impossible: {e}")
+    state = {'pending': [], 'results': [], 'errors': []}
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(get_account_regions, acct['Id']) for acct in accounts]
+        for acct, future in zip(accounts, futures):
+            try:
+                state['pending'].extend([acct['Id'], acct['Name'], region] for region in future.result())
+            except Exception as e:
+                print(f"Régions du compte {acct['Id']} introuvables: {e}")
+                state['errors'].append([acct['Id'], acct['Name'], '*', str(e)])
+    return state
 
-    now = datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S')
-    filename = f"lambda-python39-audit-{now}.csv"
-    filepath = os.path.join(tempfile.gettempdir(), filename)
-
-    with open(filepath, 'w', newline='') as csvfile:
-        fieldnames = ['AccountName', 'AccountId', 'FunctionName', 'Runtime', 'ARN']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        for row in results:
-            writer.writerow(row)
-
-    sns = boto3.client('sns')
-    with open(filepath, 'r') as f:
-        content = f.read()
-
-    sns.publish(
-        TopicArn=SNS_TOPIC_ARN,
-        Subject="Audit des fonctions Lambda en Python <= 3.9",
-        Message=f"Voici les fonctions Lambda utilisant Python <= 3.9:\n\n{content}"
-    )
+def run_shards(state, context):
+    """Traite les shards (compte, région) en parallèle tant que le timeout est assez loin.
+
+    Les shards non démarrés restent dans state['pending'] pour l'invocation suivante, de même
+    que ceux encore en cours quand la marge est atteinte : ils seront refaits entièrement.
+    """
+    pending = list(state['pending'])
+    in_flight = {}
+    started = 0
+    finished = 0
+    executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    try:
+        while pending or in_flight:
+            # Au moins un shard par invocation : la chaîne de relances progresse toujours
+            while (pending and len(in_flight) < MAX_WORKERS
+                   and (not started or context.get_remaining_time_in_millis() > DEADLINE_MARGIN_MS)):
+                shard = pending.pop(0)
+                started += 1
+                in_flight[executor.submit(list_lambdas_for_region, *shard)] = shard
+            if not in_flight:
+                break
+            # Tant qu'aucun shard n'est terminé, l'attente va jusqu'à la réserve de sauvegarde seulement
+            margin_ms = DEADLINE_MARGIN_MS if finished else CHECKPOINT_RESERVE_MS
+            timeout = max(context.get_remaining_time_in_millis() - margin_ms, 0) / 1000
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Shards bloqués (retries, attente de débit) : remis en attente plutôt que d'atteindre le timeout
+                print(f"Marge atteinte, {len(in_flight)} shards en cours remis en attente")
+                pending = list(in_flight.values()) + pending
+                in_flight.clear()
+                break
+            for future in done:
+                shard = in_flight.pop(future)
+                finished += 1
+                try:
+                    state['results'].extend(future.result())
+                except Exception as e:
+                    print(f"Erreur pour le compte {shard[0]} en {shard[2]}: {e}")
+                    state['errors'].append(shard + [str(e)])
+    finally:
+        # Sans attendre les shards abandonnés : leurs threads finiront en arrière-plan
+        executor.shutdown(wait=False, cancel_futures=True)
+    state['pending'] = pending
+
+def lambda_handler(event, context):
+    store = get_checkpoint_store()
+    if event.get('resume'):
+        state = store.load()
+        if state is None:
+            # Jamais de nouvel audit sur une relance : il repartirait de zéro à chaque invocation
+            raise RuntimeError("Reprise demandée mais aucun checkpoint trouvé, audit abandonné.")
+    else:
+        state = new_audit_state()
+
+    run_shards(state, context)
+
+    if state['pending']:
+        # Timeout proche : sauvegarde de la progression
+        store.save(state)
+        if not CHECKPOINT_BUCKET:
+            print("Pas de CHECKPOINT_BUCKET : pas de relance automatique, checkpoint local conservé.")
+            return {
+                'statusCode': 202,
+                'body': json.dumps(f"Audit interrompu. {len(state['pending'])} shards restants, "
+                                   f"reprise manuelle avec {{'resume': true}}.")
+            }
+        # Relance asynchrone de la fonction, qui reprendra depuis le checkpoint S3
+        get_client('lambda').invoke(
+            FunctionName=context.invoked_function_arn,
+            InvocationType='Event',
+            Payload=json.dumps({'resume': True})
+        )
+        return {
+            'statusCode': 202,
+            'body': json.dumps(f"Audit en cours. {len(state['pending'])} shards restants.")
+        }
+
+    # Tous les shards sont terminés : le rapport peut partir
+    results = sorted(state['results'], key=lambda r: (r['AccountName'], r['AccountId'], r['ARN']))
+    try:
+        publish_report(results, state['errors'])
+    except Exception:
+        # Résultats complets gardés : une reprise avec {'resume': true} republie sans rien rescanner
+        store.save(state)
+        raise
+    # Le checkpoint n'est supprimé qu'une fois le rapport publié
+    store.clear()
 
     return {
         'statusCode': 200,
         'body': json.dumps(f"Audit terminé. {len(results)} fonctions détectées.")
     }
+
+def upload_report(rows, s3, bucket, key):
+    """Écrit les lignes en CSV compressé (gzip) directement dans un upload multipart S3.
+
+    Returns:
+        tuple: (Counter par compte, Counter par runtime)
+    """
+    by_account = Counter()
+    by_runtime = Counter()
+    with S3MultipartWriter(s3, bucket, key) as upload:
+        with gzip.GzipFile(fileobj=upload, mode='wb') as gz:
+            with io.TextIOWrapper(gz, encoding='utf-8', newline='') as text:
+                writer = csv.DictWriter(text, fieldnames=CSV_FIELDNAMES)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    by_account[(row['AccountName'], row['AccountId'])] += 1
+                    by_runtime[row['Runtime']] += 1
+    return by_account, by_runtime
+
+def publish_report(results, errors):
+    now = datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S')
+    bucket = os.environ['REPORT_BUCKET']
+    key = f"{REPORT_PREFIX}lambda-python39-audit-{now}.csv.gz"
+
+    s3 = get_s3_client()
+    by_account, by_runtime = upload_report(results, s3, bucket, key)
+    url = s3.generate_presigned_url(
+        'get_object', Params={'Bucket': bucket, 'Key': key}, ExpiresIn=REPORT_URL_EXPIRES
+    )
+
+    # Message SNS compact : des compteurs et un lien, jamais le CSV lui-même (limite de 256 Ko)
+    lines = [f"{len(results)} fonctions Lambda utilisent Python <= 3.9.", "", "Par compte :"]
+    lines += [f"  {name} ({account_id}) : {count}" for (name, account_id), count in sorted(by_account.items())]
+    lines += ["", "Par runtime :"]
+    lines += [f"  {runtime} : {count}" for runtime, count in sorted(by_runtime.items())]
+    if errors:
+        lines += ["", f"{len(errors)} couples compte/région n'ont pas pu être audités :"]
+        lines += [f"  {account_id} ({region}): {error}" for account_id, _, region, error in errors[:50]]
+        if len(errors) > 50:
+            lines.append(f"  ... et {len(errors) - 50} autres")
+    lines += [
+        "",
+        f"Rapport complet (CSV gzip) : {url}",
+        f"Lien valable {REPORT_URL_EXPIRES // 60} min au plus (limité par la session du rôle de la fonction) ;",
+        f"le rapport reste ensuite disponible dans s3://{bucket}/{key}",
+    ]
+
+    get_client('sns').publish(
+        TopicArn=os.environ['SNS_TOPIC_ARN'],
+        Subject="Audit des fonctions Lambda en Python <= 3.9",
+        Message="\n".join(lines)
+    )
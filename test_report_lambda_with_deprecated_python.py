@@ -0,0 +1,143 @@
+"""Tests du checkpoint de report_lambda_with_deprecated_python (sauvegarde, reprise, publication)
+
+Usage :
+    python -m unittest test_report_lambda_with_deprecated_python
+
+Aucun appel AWS : les comptes, le scan des régions et la publication sont remplacés
+par des mocks, et le checkpoint est écrit dans un fichier local (LocalCheckpointStore).
+"""
+
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import report_lambda_with_deprecated_python as audit
+
+ACCOUNTS = [{'Id': '111111111111', 'Name': 'prod'}]
+REGIONS = ['eu-west-1', 'eu-west-3', 'us-east-1']
+
+
+class NoTimeLeftContext:
+    """Contexte Lambda arrivé à la marge : une seule shard est traitée par invocation."""
+
+    invoked_function_arn = 'arn:aws:lambda:eu-west-1:111111111111:function:audit'
+
+    def get_remaining_time_in_millis(self):
+        return audit.DEADLINE_MARGIN_MS
+
+
+class DeadlineContext(NoTimeLeftContext):
+    """Contexte Lambda dont le temps restant s'écoule réellement."""
+
+    def __init__(self, timeout_ms):
+        self.deadline = time.monotonic() + timeout_ms / 1000
+
+    def get_remaining_time_in_millis(self):
+        return int((self.deadline - time.monotonic()) * 1000)
+
+
+def fake_list_lambdas_for_region(account_id, account_name, region):
+    return [{
+        'AccountName': account_name,
+        'AccountId': account_id,
+        'FunctionName': f'fn-{region}',
+        'Runtime': 'python3.9',
+        'ARN': f'arn:aws:lambda:{region}:{account_id}:function:fn-{region}'
+    }]
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        self.checkpoint_file = os.path.join(tmp_dir.name, 'checkpoint.json')
+        self.addCleanup(mock.patch.stopall)
+        mock.patch.object(audit, 'CHECKPOINT_BUCKET', None).start()
+        mock.patch.object(audit, 'CHECKPOINT_FILE', self.checkpoint_file).start()
+        mock.patch.object(audit, 'CONFIG_AGGREGATOR_NAME', None).start()
+        mock.patch.object(audit, 'get_active_accounts', return_value=ACCOUNTS).start()
+        mock.patch.object(audit, 'get_account_regions', return_value=REGIONS).start()
+        mock.patch.object(audit, 'list_lambdas_for_region', side_effect=fake_list_lambdas_for_region).start()
+        self.get_client = mock.patch.object(audit, 'get_client').start()
+        self.publish_report = mock.patch.object(audit, 'publish_report').start()
+
+    def test_save_resume_publish(self):
+        response = audit.lambda_handler({}, NoTimeLeftContext())
+        self.assertEqual(response['statusCode'], 202)
+        self.assertTrue(os.path.exists(self.checkpoint_file))
+        # Sans CHECKPOINT_BUCKET, la fonction ne se relance pas elle-même
+        self.get_client.assert_not_called()
+        self.publish_report.assert_not_called()
+
+        self.assertEqual(audit.lambda_handler({'resume': True}, NoTimeLeftContext())['statusCode'], 202)
+        response = audit.lambda_handler({'resume': True}, NoTimeLeftContext())
+        self.assertEqual(response['statusCode'], 200)
+
+        self.publish_report.assert_called_once()
+        results, errors = self.publish_report.call_args.args
+        self.assertEqual([r['FunctionName'] for r in results], [f'fn-{region}' for region in REGIONS])
+        self.assertEqual(errors, [])
+        self.assertFalse(os.path.exists(self.checkpoint_file))
+
+    def test_self_invokes_with_s3_checkpoint(self):
+        store = audit.LocalCheckpointStore(self.checkpoint_file)
+        with mock.patch.object(audit, 'CHECKPOINT_BUCKET', 'audit-bucket'), \
+                mock.patch.object(audit, 'get_checkpoint_store', return_value=store):
+            response = audit.lambda_handler({}, NoTimeLeftContext())
+        self.assertEqual(response['statusCode'], 202)
+        self.get_client.return_value.invoke.assert_called_once()
+        self.assertTrue(os.path.exists(self.checkpoint_file))
+
+    def test_resume_without_checkpoint_fails(self):
+        with self.assertRaises(RuntimeError):
+            audit.lambda_handler({'resume': True}, NoTimeLeftContext())
+        self.publish_report.assert_not_called()
+
+    def test_publish_failure_keeps_results(self):
+        with mock.patch.object(audit, 'get_account_regions', return_value=REGIONS[:1]):
+            self.publish_report.side_effect = KeyError('REPORT_BUCKET')
+            with self.assertRaises(KeyError):
+                audit.lambda_handler({}, NoTimeLeftContext())
+        self.assertTrue(os.path.exists(self.checkpoint_file))
+
+        # La reprise republie les résultats gardés, sans rescanner
+        self.publish_report.side_effect = None
+        audit.list_lambdas_for_region.reset_mock()
+        self.assertEqual(audit.lambda_handler({'resume': True}, NoTimeLeftContext())['statusCode'], 200)
+        audit.list_lambdas_for_region.assert_not_called()
+        results, _ = self.publish_report.call_args.args
+        self.assertEqual(len(results), 1)
+        self.assertFalse(os.path.exists(self.checkpoint_file))
+
+    def test_stuck_shard_is_checkpointed_before_timeout(self):
+        released = threading.Event()
+        self.addCleanup(released.set)
+
+        def list_lambdas(account_id, account_name, region):
+            if region == 'eu-west-3':
+                released.wait()  # shard bloquée (retries, attente de débit...)
+            return fake_list_lambdas_for_region(account_id, account_name, region)
+
+        with mock.patch.object(audit, 'get_account_regions', return_value=REGIONS[:2]), \
+                mock.patch.object(audit, 'list_lambdas_for_region', side_effect=list_lambdas), \
+                mock.patch.object(audit, 'DEADLINE_MARGIN_MS', 1000), \
+                mock.patch.object(audit, 'CHECKPOINT_RESERVE_MS', 500):
+            start = time.monotonic()
+            response = audit.lambda_handler({}, DeadlineContext(1500))
+            elapsed = time.monotonic() - start
+
+        # Retour avant le timeout de la fonction, shard bloquée remise en attente et sauvegardée
+        self.assertEqual(response['statusCode'], 202)
+        self.assertLess(elapsed, 1.5)
+        state = audit.LocalCheckpointStore(self.checkpoint_file).load()
+        self.assertEqual(state['pending'], [['111111111111', 'prod', 'eu-west-3']])
+        self.assertEqual([r['FunctionName'] for r in state['results']], ['fn-eu-west-1'])
+        self.publish_report.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()